@@ -0,0 +1,55 @@
+from .utils import typename, enquote, print_skip_warning
+
+
+class LazyChannel:
+    """
+    Placeholder for a channel that is only created on first access via resolve(),
+    the created channel (or the failure) is memoized such that all containers holding this placeholder share the same channel.
+    If creating the channel fails, a skip warning is issued once and resolve() returns None.
+    """
+
+    def __init__(self, name, factory, *args):
+        self.name = name
+        self._factory = factory
+        self._args = args
+        self._chan = None
+        self._failed = False
+
+    def resolve(self):
+        if self._chan is None and not self._failed:
+            try:
+                self._chan = self._factory(self.name, *self._args)
+            except Exception as exc:
+                self._failed = True
+                cn = enquote(self.name)
+                cn = f"channel {cn}"
+                print_skip_warning(exc, cn)
+            self._args = None # drop the reference to the group
+        return self._chan
+
+    @property
+    def resolved(self):
+        return self._chan is not None or self._failed
+
+    @property
+    def failed(self):
+        return self._failed
+
+    def close(self):
+        chan = self._chan
+        if chan is not None:
+            chan.close()
+
+    def refresh(self):
+        chan = self._chan
+        if chan is not None:
+            chan.refresh()
+
+    def __repr__(self):
+        tn = typename(self)
+        name = enquote(self.name)
+        state = "resolved" if self.resolved else "unresolved"
+        return f"{tn}({name}): {state}"
+
+
+
@@ -19,11 +19,10 @@ class SubSetter(Selector):
 
 
 def get_general(sfd):
-    shared_pids = sfd.pids
-    all_pids    = sfd.all_pids
+    alignment = sfd.alignment
 
-    n_shared_pids = len(shared_pids)
-    n_all_pids    = len(all_pids)
+    n_shared_pids = alignment.nshared
+    n_all_pids    = alignment.nall
 
     return n_shared_pids, n_all_pids
 
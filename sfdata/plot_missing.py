@@ -6,16 +6,16 @@ from matplotlib.colors import ListedColormap
 def plot_missing(sfd, show_pids=False, **kwargs):
     data = {}
 
-    sfd.reset_valid()
-    pids = sfd.all_pids
-    sfd.drop_missing()
+    alignment = sfd.alignment
+    pids = alignment.all_pids
 
     start = min(pids)
     stop = max(pids)
     N = stop - start + 1
 
-    for name, chan in sfd.items():
-        bools = indices_to_boolean(chan.valid, N)
+    positions = pids - start
+    for name, ind in zip(alignment.names, alignment.index_maps):
+        bools = indices_to_boolean(positions[ind], N)
         data[name] = bools
 
     xlabel = "Pulse Indices"
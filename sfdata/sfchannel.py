@@ -3,7 +3,7 @@ import numpy as np
 
 from .sfmeta import SFMeta, get_meta
 from .errors import DatasetNotInGroupError
-from .utils import typename, adjust_shape, batched, apply_batched, ClosedH5, FileStatus
+from .utils import typename, adjust_shape, batched, apply_batched, read_valid, get_memmap, ClosedH5, FileStatus, PIDRanges, DirectChunkDataset, is_direct_readable
 
 
 NAME_CHAN_DATA = "data"
@@ -14,35 +14,105 @@ NAME_CHAN_META = "meta"
 
 class SFChannel:
 
-    def __init__(self, name, group):
+    _info = None # structure from the file index (see FileIndex), if given, the datasets are only opened on first access
+
+    def __init__(self, name, group, info=None):
         self.name = name
         self._group = group
         self.fs = FileStatus(group.file.filename)
-        self.datasets = SimpleNamespace(
-            data = get_dataset(NAME_CHAN_DATA, group),
-            pids = get_dataset(NAME_CHAN_PIDS, group),
-            timestamps = group.get(NAME_CHAN_TIMESTAMPS) # treat timestamps as optional
-        )
+        if info is None:
+            self.datasets = SimpleNamespace(
+                data = get_dataset(NAME_CHAN_DATA, group),
+                pids = get_dataset(NAME_CHAN_PIDS, group),
+                timestamps = group.get(NAME_CHAN_TIMESTAMPS) # treat timestamps as optional
+            )
+        else:
+            self._info = info
+            self.datasets = LazyDatasets(group)
         self.meta = get_meta(group, NAME_CHAN_META)
+        self._init_state()
+
+    def _init_state(self):
+        self._raw_pids = None   # all pids as read from the file
+        self._pids = None       # valid pids with offset applied
+        self._pid_ranges = None # range-encoded version of _pids
         self.offset = 0
+        self.mmap = False
+        self.decompress_threads = None # decompress bitshuffle/LZ4 chunks in this many threads (see DirectChunkDataset)
+        self._nseen = 0 # number of valid entries already delivered via in_batches/apply_in_batches with new=True
         self.reset_valid()
 
     def close(self):
+        self._info = None
         self._group = ClosedH5(self._group)
         self.datasets.data = ClosedH5(self.datasets.data)
         self.datasets.pids = ClosedH5(self.datasets.pids)
+        self.clear_cache()
         if self.meta:
             self.meta.close()
 
-    def in_batches(self, size=100, n=None):
-        dataset = self.datasets.data
+    def clear_cache(self):
+        self._raw_pids = None
+        self._clear_pids_cache()
+
+    def _clear_pids_cache(self):
+        self._pids = None
+        self._pid_ranges = None
+
+    def in_batches(self, size=100, n=None, aligned=False, prefetch=0, new=False, dtype=None):
+        dataset = self._get_data_dataset()
+        if new:
+            return self._in_new_batches(size, n, aligned, prefetch, dtype)
         valid_indices = self._get_valid_indices()
-        return batched(dataset, valid_indices, size, nbatches=n)
+        return batched(dataset, valid_indices, size, nbatches=n, aligned=aligned, prefetch=prefetch, read_dtype=dtype)
 
-    def apply_in_batches(self, func, size=100, n=None):
-        dataset = self.datasets.data
+    def apply_in_batches(self, func, size=100, n=None, aligned=False, prefetch=0, workers=None, new=False, dtype=None, res_dtype=None, out=None):
+        dataset = self.datasets.data if workers else self._get_data_dataset() # worker processes reopen the hdf5 dataset
+        if new:
+            start, valid_indices = self._get_new_indices()
+        else:
+            valid_indices = self._get_valid_indices()
+        res = apply_batched(func, dataset, valid_indices, size, nbatches=n, aligned=aligned, prefetch=prefetch, workers=workers, read_dtype=dtype, dtype=res_dtype, out=out)
+        if new:
+            self._nseen = start + len(res)
+        return res
+
+    def _in_new_batches(self, size, n, aligned, prefetch, dtype):
+        """
+        Like in_batches but only over the valid entries that have not been delivered with new=True before,
+        the yielded index slices refer to all valid entries, i.e., they can be used with pids
+        """
+        dataset = self._get_data_dataset()
+        start, valid_indices = self._get_new_indices()
+        for index_slice, batch in batched(dataset, valid_indices, size, nbatches=n, aligned=aligned, prefetch=prefetch, read_dtype=dtype):
+            stop = start + min(index_slice.stop, len(valid_indices))
+            index_slice = slice(start + index_slice.start, stop)
+            self._nseen = stop
+            yield index_slice, batch
+
+    def _get_new_indices(self):
+        """
+        Valid indices that have not been delivered with new=True before and for which both data and pids have been written,
+        returns the position of the first one within all valid indices and the indices
+        """
         valid_indices = self._get_valid_indices()
-        return apply_batched(func, dataset, valid_indices, size, nbatches=n)
+        nwritten = min(self.datasets.data.shape[0], self.ntotal) # the writer may have extended one dataset but not yet the other
+        nready = np.searchsorted(valid_indices, nwritten)
+        start = min(self._nseen, nready)
+        return start, valid_indices[start:nready]
+
+    def refresh(self):
+        """
+        Update the dataset extents to include entries that were written since opening the file,
+        for files that are still being written (see SFDataFile with follow=True)
+        """
+        datasets = (self.datasets.data, self.datasets.pids, self.datasets.timestamps)
+        for ds in datasets:
+            refresh = getattr(ds, "refresh", None) # e.g., not available for jungfrau_utils files
+            if refresh is not None:
+                refresh()
+        self._info = None # the index describes the file as it was
+        self.clear_cache()
 
 
     def __getitem__(self, key):
@@ -62,11 +132,82 @@ class SFChannel:
 
     @property
     def data(self):
-        return self._get(self.datasets.data)
+        return self.read()
+
+    def read(self, out=None, dtype=None):
+        """
+        Read the valid entries of the data,
+        if out is given (e.g., a preallocated array or an np.memmap of shape ch.shape), they are read directly into it,
+        otherwise, if dtype is given, they are converted to dtype while reading
+        """
+        dataset = self.datasets.data
+        if self.mmap:
+            mapped = get_memmap(dataset)
+            if mapped is not None: # otherwise fall back to reading via h5py
+                return self._get(mapped, out=out, dtype=dtype)
+        dataset = self._get_data_dataset()
+        return self._get(dataset, out=out, dtype=dtype)
+
+    def _get_data_dataset(self):
+        """
+        The data dataset, wrapped for parallel decompression if decompress_threads is set and the dataset supports it,
+        otherwise (e.g., for other filters) the data is read via the hdf5 filter pipeline
+        """
+        dataset = self.datasets.data
+        if self.decompress_threads and is_direct_readable(dataset):
+            dataset = DirectChunkDataset(dataset, workers=self.decompress_threads)
+        return dataset
 
     @property
     def pids(self):
-        return self._get(self.datasets.pids) - self.offset
+        """
+        Valid pulse IDs with offset applied,
+        cached until offset or valid change, and read-only to protect the cache
+        """
+        pids = self._pids
+        if pids is None:
+            raw_pids = self._get_raw_pids()
+            pids = self._get(raw_pids) - self.offset
+            pids.setflags(write=False)
+            self._pids = pids
+        return pids
+
+    @property
+    def pid_ranges(self):
+        """
+        Valid pulse IDs with offset applied as compact PIDRanges,
+        cached like pids, raises ValueError if the pulse IDs are not strictly increasing
+        """
+        ranges = self._pid_ranges
+        if ranges is None:
+            ranges = PIDRanges.from_array(self.pids)
+            self._pid_ranges = ranges
+        return ranges
+
+    def _get_raw_pids(self):
+        raw_pids = self._raw_pids
+        if raw_pids is None:
+            raw_pids = self.datasets.pids[:]
+            self._raw_pids = raw_pids
+        return raw_pids
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @offset.setter
+    def offset(self, value):
+        self._offset = value
+        self._clear_pids_cache()
+
+    @property
+    def valid(self):
+        return self._valid
+
+    @valid.setter
+    def valid(self, value):
+        self._valid = value
+        self._clear_pids_cache()
 
     @property
     def timestamps(self):
@@ -76,13 +217,16 @@ class SFChannel:
         # 0123456789xyzABCDEF -> 0123456789 unix timestamp in seconds, xyz milliseconds, ABCDEF last 6 digits of pulse ID
         return self._get(ts).astype("datetime64[ns]") 
 
-    def _get(self, dataset):
-        res = dataset[:][self.valid] #TODO: workaround: access from h5 via indices is slow
-        res = adjust_shape(res)
+    def _get(self, dataset, out=None, dtype=None):
+        res = read_valid(dataset, self.valid, out=out, dtype=dtype)
+        res = adjust_shape(res) # a view for column vectors
         return res
 
     @property
     def dtype(self):
+        info = self._info
+        if info is not None and info.dtype is not None:
+            return np.dtype(info.dtype)
         return self.datasets.data.dtype
 
     @property
@@ -96,7 +240,8 @@ class SFChannel:
     @property
     def shape(self):
         first_dim = self.nvalid
-        other_dims = self.datasets.data.shape[1:]
+        info = self._info
+        other_dims = info.shape[1:] if info is not None else self.datasets.data.shape[1:]
         shape = (first_dim, *other_dims)
         return shape
 
@@ -105,6 +250,9 @@ class SFChannel:
 
     @property
     def ntotal(self):
+        info = self._info
+        if info is not None:
+            return info.ntotal
         return self.datasets.pids.shape[0]
 
     @property
@@ -116,8 +264,17 @@ class SFChannel:
             return len(valid)
 
     def reset_valid(self):
+        self.valid = self._initial_valid()
+
+    def _initial_valid(self):
         #TODO: check "is_data_present" for valid entries, initialize from these
-        self.valid = Ellipsis
+        return Ellipsis
+
+    def _get_reset_pids(self):
+        """Pulse IDs with offset applied as they are after reset_valid(), but without changing valid"""
+        raw_pids = self._get_raw_pids()
+        pids = read_valid(raw_pids, self._initial_valid())
+        return adjust_shape(pids) - self.offset
 
     def _get_valid_indices(self):
         valid = self.valid
@@ -138,6 +295,30 @@ class SFChannel:
 
 
 
+class LazyDatasets:
+    """
+    Datasets of a channel group that are only opened on first access,
+    missing data/pids raise DatasetNotInGroupError and missing timestamps are None (as for SFChannel)
+    """
+
+    def __init__(self, group):
+        self._group = group
+
+    def __getattr__(self, name): # only called for attributes that have not been set yet
+        group = self._group
+        if name == "data":
+            res = get_dataset(NAME_CHAN_DATA, group)
+        elif name == "pids":
+            res = get_dataset(NAME_CHAN_PIDS, group)
+        elif name == "timestamps":
+            res = group.get(NAME_CHAN_TIMESTAMPS)
+        else:
+            raise AttributeError(name)
+        setattr(self, name, res)
+        return res
+
+
+
 def get_dataset(name, group):
     try:
         res = group[name]
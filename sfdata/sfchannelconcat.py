@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+from .sfchannel import SFChannel
+from .utils import ConcatDataset
+
+
+class SFChannelConcat(SFChannel):
+    """
+    One logical channel made from same-named channels of several files (e.g., consecutive runs),
+    the datasets of the parts are concatenated along the pulse ID axis without copying
+    """
+
+    def __init__(self, name, channels):
+        channels = list(channels)
+        if not channels:
+            raise ValueError(f"No usable parts for channel \"{name}\"")
+        self.name = name
+        self.channels = channels
+        self._group = None
+        self.fs = channels[-1].fs
+        self.datasets = SimpleNamespace(
+            data = ConcatDataset(lambda: [ch.datasets.data for ch in self.channels]),
+            pids = ConcatDataset(lambda: [ch.datasets.pids for ch in self.channels]),
+            timestamps = self._concat_timestamps()
+        )
+        self.meta = channels[-1].meta
+        self._init_state()
+
+    def _concat_timestamps(self):
+        if any(ch.datasets.timestamps is None for ch in self.channels):
+            return None
+        return ConcatDataset(lambda: [ch.datasets.timestamps for ch in self.channels])
+
+    def close(self):
+        # the parts belong to (and are closed with) their files
+        self.clear_cache()
+
+
+
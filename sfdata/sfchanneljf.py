@@ -22,17 +22,16 @@ class SFChannelJF(SFChannel):
         shape = (nimages, *image_shape)
         return shape
 
-    def reset_valid(self):
-        self.valid = Ellipsis
+    def _initial_valid(self):
         # load "is_good_frame", check for any invalid entries, initialize from it
         good = self.juf.file.get(f"data/{self.name}/is_good_frame")
         if good is None:
-            return
+            return Ellipsis
         good = good[:]
         if good.all():
-            return
+            return Ellipsis
         good = good.reshape(-1).nonzero()[0] # nonzero returns a tuple of arrays, one for each dimension also for 1D
-        self.valid = good
+        return good
 
     #TODO: this is workaround for a memory leak
     def close(self):
@@ -0,0 +1,168 @@
+import numpy as np
+
+from .errors import ArrayLengthMismatch
+from .utils import typename, enquote, FileContext, DirectChunkWriter, get_chunk_shape, get_bshuf_kwargs
+from .sfchannel import NAME_CHAN_DATA, NAME_CHAN_PIDS
+
+
+DEFAULT_PIDS_DTYPE = np.int64
+DEFAULT_DATA_DTYPE = np.float64
+
+COMPRESSIONS = (None, "bitshuffle")
+
+
+class SFChannelWriter(FileContext):
+    """
+    Channel of an SFProcFile that is written piece by piece into resizable, chunked datasets,
+    pids and data can be appended together or separately, and need to have the same length at close().
+    The datasets are created on the first append, where shape (of one entry) and dtype are taken from the appended data
+    unless given explicitly. The chunk shapes are chosen automatically (see get_chunk_shape).
+    compression="bitshuffle" compresses the data with bitshuffle/LZ4 in worker threads and writes whole chunks directly
+    (see DirectChunkWriter), the result can be read like any other bitshuffle-compressed dataset.
+    If submit is given, the write operations are handed to it (e.g., BackgroundWriter.submit) instead of being run directly,
+    the appended arrays are copied in this case, such that the caller can reuse them right away. Closing is handed to submit_always if given (e.g., BackgroundWriter.submit_always),
+    such that the datasets are completed even if an earlier write failed.
+    """
+
+    def __init__(self, name, group, shape=None, dtype=None, compression=None, workers=None, on_close=None, submit=None, submit_always=None):
+        if compression not in COMPRESSIONS:
+            allowed = ", ".join(str(c) for c in COMPRESSIONS)
+            raise ValueError(f"Invalid compression; must be one of {allowed}")
+
+        self.name = name
+        self._group = group
+        self._shape = tuple(shape) if shape is not None else None
+        self._dtype = dtype
+        self._compression = compression
+        self._workers = workers
+        self._direct = None
+        self._on_close = on_close
+        self._submit = submit or call
+        self._copy = submit is not None # the write happens later
+        self._submit_always = submit_always or self._submit
+        self._pids = None
+        self._data = None
+        self.closed = False
+
+
+    def __repr__(self):
+        tn = typename(self)
+        name = enquote(self.name)
+        return f"{tn}({name}): {self.npids} pids, {self.ndata} data entries"
+
+    @property
+    def npids(self):
+        return 0 if self._pids is None else self._pids.shape[0]
+
+    @property
+    def ndata(self):
+        return 0 if self._data is None else self._data.shape[0]
+
+
+    def append(self, pids, data):
+        pids = np.asarray(pids)
+        data = np.asarray(data)
+        npids = len(pids)
+        ndata = len(data)
+        if npids != ndata:
+            raise ArrayLengthMismatch(self.name, npids, ndata)
+        self.append_pids(pids)
+        self.append_data(data)
+
+    def append_pids(self, pids):
+        pids = self._as_array(pids)
+        self._submit(self._append_pids, pids)
+
+    def append_data(self, data):
+        data = self._as_array(data)
+        self._submit(self._append_data, data)
+
+    def _as_array(self, values):
+        return np.array(values) if self._copy else np.asarray(values)
+
+    def _append_pids(self, pids):
+        if self._pids is None:
+            self._pids = self._create_dataset(NAME_CHAN_PIDS, (), pids.dtype)
+        append_to_dataset(self._pids, pids)
+
+    def _append_data(self, data):
+        if self._data is None:
+            shape = self._shape if self._shape is not None else data.shape[1:]
+            dtype = self._dtype if self._dtype is not None else data.dtype
+            self._data = self._create_data_dataset(shape, dtype)
+        if self._direct is not None:
+            self._direct.append(data)
+        else:
+            append_to_dataset(self._data, data)
+
+
+    def append_batches(self, chan, func, size=100, n=None, aligned=False, prefetch=0):
+        """
+        Apply func to the batches of chan (an SFChannel, see SFChannel.in_batches)
+        and append the results together with the matching pids one batch at a time
+        """
+        pids = chan.pids
+        for index_slice, batch in chan.in_batches(size=size, n=n, aligned=aligned, prefetch=prefetch):
+            self.append(pids[index_slice], func(batch))
+
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._submit_always(self._finish)
+
+    def _finish(self):
+        if self._pids is None:
+            self._pids = self._create_dataset(NAME_CHAN_PIDS, (), DEFAULT_PIDS_DTYPE)
+        if self._data is None:
+            shape = self._shape or ()
+            dtype = self._dtype or DEFAULT_DATA_DTYPE
+            self._data = self._create_data_dataset(shape, dtype)
+
+        direct = self._direct
+        if direct is not None:
+            self._direct = None
+            direct.close()
+
+        npids = self.npids
+        ndata = self.ndata
+        if npids != ndata:
+            raise ArrayLengthMismatch(self.name, npids, ndata)
+
+        if self._on_close is not None:
+            self._on_close(self.name, self._group)
+
+
+    def _create_data_dataset(self, shape, dtype):
+        if self._compression is None:
+            return self._create_dataset(NAME_CHAN_DATA, shape, dtype)
+        dataset = self._create_dataset(NAME_CHAN_DATA, shape, dtype, **get_bshuf_kwargs())
+        self._direct = DirectChunkWriter(dataset, workers=self._workers)
+        return dataset
+
+    def _create_dataset(self, name, shape, dtype, **kwargs):
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+        chunks = get_chunk_shape(shape, dtype.itemsize)
+        return self._group.create_dataset(name, shape=(0, *shape), maxshape=(None, *shape), dtype=dtype, chunks=chunks, **kwargs)
+
+
+
+def call(func, *args):
+    func(*args)
+
+
+def append_to_dataset(dataset, values):
+    n = len(values)
+    if n == 0:
+        return
+    shape = dataset.shape[1:]
+    if values.shape[1:] != shape:
+        raise ValueError(f"cannot append entries of shape {values.shape[1:]} to dataset with entries of shape {shape}")
+    start = dataset.shape[0]
+    dataset.resize(start + n, axis=0)
+    dataset[start:] = values
+
+
+
@@ -4,7 +4,11 @@ import pandas as pd
 import xarray as xr
 from tqdm import tqdm
 
-from .utils import typename, percentage_missing, strlen, maxstrlen, decide_color, print_line, dip, cprint, ncprint, decide_pandas_dtype
+from .utils import typename, percentage_missing, strlen, maxstrlen, decide_color, print_line, dip, cprint, ncprint, decide_pandas_dtype, PIDAlignment, PIDRanges
+from .lazychannel import LazyChannel
+
+
+NUMERIC_KINDS = "iufc" # dtypes that a default dtype is applied to in the conversions
 
 
 #unique_intersect1d = partial(np.intersect1d, assume_unique=True)
@@ -14,37 +18,140 @@ from .utils import typename, percentage_missing, strlen, maxstrlen, decide_color
 class SFData(dict):
 
     names = property(dict.keys)
-    channels = property(dict.values)
+
+    def values(self):
+        return [chan for _name, chan in self.items()]
+
+    def items(self):
+        res = []
+        failed = []
+        for name in self.keys():
+            try:
+                chan = self._resolve(name)
+            except KeyError: # channel could not be created
+                failed.append(name)
+                continue
+            res.append((name, chan))
+        for name in failed:
+            self._drop(name)
+        return res
+
+    channels = property(values)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if not super().__contains__(key):
+            return False
+        try:
+            self._resolve_or_drop(key)
+        except KeyError: # channel could not be created and was removed
+            return False
+        return True
+
+    def _resolve(self, name):
+        """
+        Return the channel stored under name creating it first if it is a LazyChannel,
+        a KeyError is raised if the channel cannot be created.
+        Only the value of the existing key is replaced, thus, this is safe while iterating over the keys.
+        """
+        entry = super().__getitem__(name)
+        if not isinstance(entry, LazyChannel):
+            return entry
+        chan = entry.resolve()
+        if chan is None:
+            raise KeyError(name)
+        super().__setitem__(name, chan)
+        return chan
+
+    def _resolve_or_drop(self, name):
+        """Like _resolve but channels that cannot be created are removed"""
+        try:
+            return self._resolve(name)
+        except KeyError:
+            self._drop(name)
+            raise
+
+    def _drop(self, name):
+        entry = dict.get(self, name)
+        if isinstance(entry, LazyChannel) and entry.failed:
+            super().__delitem__(name)
+
+    def _entries(self):
+        """Stored entries without creating lazy channels"""
+        return dict.values(self)
 
     @property
     def pids(self):
-        return reduce(np.intersect1d, self._iter_pids())
+        try:
+            ranges = self.pid_ranges
+        except ValueError: # pids cannot be range-encoded
+            return reduce(np.intersect1d, self._iter_pids())
+        else:
+            return ranges.to_array()
 
     @property
     def all_pids(self):
-        return reduce(np.union1d, self._iter_pids())
+        try:
+            ranges = self.all_pid_ranges
+        except ValueError: # pids cannot be range-encoded
+            return reduce(np.union1d, self._iter_pids())
+        else:
+            return ranges.to_array()
+
+    @property
+    def pid_ranges(self):
+        return reduce(PIDRanges.intersection, self._iter_pid_ranges())
+
+    @property
+    def all_pid_ranges(self):
+        return reduce(PIDRanges.union, self._iter_pid_ranges())
 
     def _iter_pids(self):
         return (c.pids for c in self.values())
 
+    def _iter_pid_ranges(self):
+        return (c.pid_ranges for c in self.values())
 
-    def to_dataframe(self, as_lists=False, as_nullable=False, show_progress=False):
+    @property
+    def alignment(self):
+        """
+        PIDAlignment of the channels' pulse IDs (as after reset_valid) onto all pulse IDs,
+        cached until a channel is added/removed/replaced, its offset changes or it grows (see refresh)
+        """
+        key = tuple((name, chan, chan.offset, chan.ntotal) for name, chan in self.items())
+        cached = getattr(self, "_alignment_cache", None)
+        if cached is not None:
+            cached_key, cached_alignment = cached
+            if cached_key == key:
+                return cached_alignment
+
+        alignment = PIDAlignment(self.names, (c._get_reset_pids() for c in self.values()))
+        self._alignment_cache = (key, alignment)
+        return alignment
+
+
+    def to_dataframe(self, as_lists=False, as_nullable=False, show_progress=False, dtype=None):
         data_series = {}
         channels = self.values()
         if show_progress:
             channels = tqdm(channels)
         for chan in channels:
             name = chan.name
-            data = chan.data
-            dtype = decide_pandas_dtype(data) if as_nullable else object
+            data = chan.read(dtype=get_read_dtype(chan, dtype))
+            pd_dtype = decide_pandas_dtype(data) if as_nullable else object
             if data.ndim > 1:
                 data = data.tolist() if as_lists else list(data)
-            ds = pd.Series(data=data, index=chan.pids, dtype=dtype, name=name)
+            ds = pd.Series(data=data, index=chan.pids, dtype=pd_dtype, name=name)
             data_series[name] = ds
         df = pd.DataFrame(data_series)
         return df
 
-    def to_dataframe_accumulate(self, as_lists=False, as_nullable=False, show_progress=False):
+    def to_dataframe_accumulate(self, as_lists=False, as_nullable=False, show_progress=False, dtype=None):
         all_pids = self.all_pids
         df = pd.DataFrame(index=all_pids, columns=self.names)
         channels = self.values()
@@ -52,15 +159,15 @@ class SFData(dict):
             channels = tqdm(channels)
         for chan in channels:
             name = chan.name
-            data = chan.data
-            dtype = decide_pandas_dtype(data) if as_nullable else object
+            data = chan.read(dtype=get_read_dtype(chan, dtype))
+            pd_dtype = decide_pandas_dtype(data) if as_nullable else object
             if data.ndim > 1:
                 data = data.tolist() if as_lists else list(data)
-            ds = pd.Series(data=data, index=chan.pids, dtype=dtype, name=name)
+            ds = pd.Series(data=data, index=chan.pids, dtype=pd_dtype, name=name)
             df[name] = ds
         return df
 
-    def to_dataframe_fill(self, as_lists=False, as_nullable=False, show_progress=False):
+    def to_dataframe_fill(self, as_lists=False, as_nullable=False, show_progress=False, dtype=None):
         all_pids = self.all_pids
         df = pd.DataFrame(index=all_pids, columns=self.names, dtype=object) # object dtype makes sure NaN can be used as missing marker also for int/bool
         channels = self.values()
@@ -68,24 +175,24 @@ class SFData(dict):
             channels = tqdm(channels)
         for chan in channels:
             name = chan.name
-            data = chan.data
+            data = chan.read(dtype=get_read_dtype(chan, dtype))
             if data.ndim > 1:
                 data = data.tolist() if as_lists else list(data)
             which = np.isin(all_pids, chan.pids)
             df.loc[which, name] = data
             if as_nullable:
-                dtype = decide_pandas_dtype(data)
-                df[name] = df[name].astype(dtype)
+                pd_dtype = decide_pandas_dtype(data)
+                df[name] = df[name].astype(pd_dtype)
         return df
 
-    def to_xarray(self, show_progress=False):
+    def to_xarray(self, show_progress=False, dtype=None):
         data_vars = {}
         channels = self.values()
         if show_progress:
             channels = tqdm(channels)
         for chan in channels:
             name = chan.name
-            data = chan.data
+            data = chan.read(dtype=get_read_dtype(chan, dtype))
             coords = {"pids": chan.pids}
             dims = ["pids"] + [f"_dim{i}_{name}" for i in range(1, data.ndim)]
             da = xr.DataArray(data, coords=coords, dims=dims)
@@ -93,14 +200,14 @@ class SFData(dict):
         ds = xr.Dataset(data_vars)
         return ds
 
-    def to_xarray_accumulate(self, show_progress=False):
+    def to_xarray_accumulate(self, show_progress=False, dtype=None):
         ds = xr.Dataset(coords={"pids": self.all_pids})
         channels = self.values()
         if show_progress:
             channels = tqdm(channels)
         for chan in channels:
             name = chan.name
-            data = chan.data
+            data = chan.read(dtype=get_read_dtype(chan, dtype))
             coords = {"pids": chan.pids}
             dims = ["pids"] + [f"_dim{i}_{name}" for i in range(1, data.ndim)]
             da = xr.DataArray(data, coords=coords, dims=dims)
@@ -109,11 +216,19 @@ class SFData(dict):
 
 
     def drop_missing(self, show_stats=True, color=True, show_progress=False):
-        shared_pids = self.pids
+        """
+        Keep only the pulse IDs that are currently valid in all channels,
+        i.e., a selection made before via valid is respected
+        """
+        channels = self.values()
+        if all(c.valid is Ellipsis for c in channels):
+            alignment = self.alignment
+        else:
+            alignment = PIDAlignment(self.names, (c.pids for c in channels))
 
         if show_stats:
-            n_shared_pids = len(shared_pids)
-            n_all_pids = len(self.all_pids)
+            n_shared_pids = alignment.nshared
+            n_all_pids = alignment.nall
             max_perc = percentage_missing(n_shared_pids, n_all_pids)
 
             fprint = cprint if color else ncprint
@@ -125,8 +240,10 @@ class SFData(dict):
             channels = tqdm(channels)
 
         for chan in channels:
-            chan.reset_valid()
-            _inters, ind_chan, _ind_shared = np.intersect1d(chan.pids, shared_pids, return_indices=True)
+            ind_chan = alignment.indices_of_shared(chan._get_reset_pids())
+            initial = chan._initial_valid()
+            if initial is not Ellipsis: # indices are relative to the initially valid entries
+                ind_chan = np.asarray(initial)[ind_chan]
             chan.valid = ind_chan
 
 
@@ -135,11 +252,11 @@ class SFData(dict):
 
         fprint = cprint if color else ncprint
 
-        shared_pids = self.pids
-        all_pids = self.all_pids
+        alignment = self.alignment
+        counts = dict(zip(alignment.names, alignment.counts))
 
-        n_shared_pids = len(shared_pids)
-        n_all_pids = len(all_pids)
+        n_shared_pids = alignment.nshared
+        n_all_pids = alignment.nall
         max_perc = percentage_missing(n_shared_pids, n_all_pids)
 
         len_pids = strlen(n_all_pids)
@@ -152,9 +269,7 @@ class SFData(dict):
         n_complete = 0
         for n in sorted(self.names):
             chan = self[n]
-            chan.reset_valid()
-            inters = np.intersect1d(chan.pids, all_pids)
-            n_inters = len(inters)
+            n_inters = counts[n]
 
             is_complete = (n_inters == n_all_pids)
             if is_complete:
@@ -187,6 +302,12 @@ class SFData(dict):
         for chan in channels:
             chan.reset_valid()
 
+    def refresh(self):
+        """Update the channels to include entries written since opening (see SFDataFile with follow=True)"""
+        for chan in self._entries(): # channels that were never created will see the current state once they are
+            chan.refresh()
+        self._alignment_cache = None
+
     def save_names(self, fname, mode="x", **kwargs):
         with open(fname, mode=mode, **kwargs) as f:
             names = sorted(self.names)
@@ -198,11 +319,11 @@ class SFData(dict):
         self[channel.name] = channel
 
     def __getitem__(self, key):
-        super_getitem = super().__getitem__
+        resolve = self._resolve_or_drop
         if isinstance(key, str):
-            return super_getitem(key)
+            return resolve(key)
         try:
-            chans = {k: super_getitem(k) for k in key} #TODO: should subsetting copy channels (separate .valid)?
+            chans = {k: resolve(k) for k in key} #TODO: should subsetting copy channels (separate .valid)?
         except TypeError as exc:
             raise KeyError(key) from exc
         else:
@@ -215,3 +336,16 @@ class SFData(dict):
 
 
 
+def get_read_dtype(chan, dtype):
+    """
+    Target dtype for reading chan, dtype can be None, a dict {name: dtype}
+    or a single dtype that is applied to all channels with numeric (not bool, str, etc.) data
+    """
+    if isinstance(dtype, dict):
+        return dtype.get(chan.name)
+    if dtype is not None and chan.dtype.kind in NUMERIC_KINDS:
+        return dtype
+    return None
+
+
+
@@ -3,11 +3,12 @@ from warnings import warn
 import h5py
 import bitshuffle.h5
 
-from .errors import NoUsableChannelError
-from .utils import typename, enquote, print_skip_warning, FileDemultiplexer, FileContext, FileStatus
+from .errors import NoUsableChannelError, DatasetNotInGroupError
+from .utils import typename, enquote, print_skip_warning, FileDemultiplexer, FileContext, FileStatus, FileIndex, load_index, get_index_filename, get_profile_kwargs, open_h5_with_profile
 from .sfdata import SFData
-from .sfchannel import SFChannel
+from .sfchannel import SFChannel, NAME_CHAN_DATA, NAME_CHAN_PIDS
 from .sfchanneljf import SFChannelJF
+from .lazychannel import LazyChannel
 from .sfmeta import get_meta
 
 #TODO: treat ju as optional for now
@@ -23,16 +24,22 @@ NAME_FILE_DATA_ROOT = "data"
 
 class SFDataFile(FileContext, SFData):
 
-    def __init__(self, fname):
+    def __init__(self, fname, index=False, profile=None, follow=False):
         self.fname = fname
         self.fs = FileStatus(fname)
-        self.file, channels = load_from_file(fname)
+        self.follow = follow
+        if follow: # open such that a concurrent SWMR writer can keep appending, see refresh()
+            profile = {**get_profile_kwargs(profile), "swmr": True}
+        self.index = load_index(fname) if index else None
+        self.file, channels = load_from_file(fname, self.index, profile)
+        if index and self.index is None:
+            self.index = build_index(fname, channels)
         self.meta = get_meta(self.file, NAME_FILE_META)
         super().__init__(channels)
 
     def close(self):
         # channels and meta should be closed before the underlying file such that file name and group name still exist and can be used in error messages
-        for ch in self.channels:
+        for ch in self._entries(): # channels that were never created do not need to be closed
             ch.close()
         if self.meta:
             self.meta.close()
@@ -46,14 +53,14 @@ class SFDataFile(FileContext, SFData):
 
 
 
-def load_from_file(fname):
+def load_from_file(fname, index=None, profile=None):
     if ".JF" in fname: #TODO: might need better check
         if ju:
             return load_from_ju_file(fname)
         else:
             warn("Could not import jungfrau_utils, will treat JF files as regular files.", stacklevel=2)
 
-    return load_from_generic_file(fname)
+    return load_from_generic_file(fname, index, profile)
 
 
 def load_from_ju_file(fname):
@@ -86,27 +93,40 @@ def load_from_ju_file_multiple_channels(fname, names):
     return fdemux, chans
 
 
-def load_from_generic_file(fname):
-    h5 = h5py.File(fname, mode="r")
+def load_from_generic_file(fname, index=None, profile=None):
+    h5 = open_h5_with_profile(fname, mode="r", profile=profile)
 
     if NAME_FILE_DATA_ROOT in h5:
         data = h5[NAME_FILE_DATA_ROOT] # some files have /data/, e.g., bsread
     else:
         data = h5 # some files do not, e.g., camera
 
+    if index is not None:
+        # the index only lists usable channels and already contains their pulse IDs
+        channels = {name: LazyChannel(name, load_indexed_channel, data, index) for name in index.names}
+        if not channels:
+            raise NoUsableChannelError(fname)
+        return h5, channels
+
     channels = {}
     for name in data:
         if name == NAME_FILE_META: # skip the file meta data group
             continue
-        group = data[name]
-        try:
-            chan = SFChannel(name, group)
-        except Exception as exc:
-            cn = enquote(name)
-            cn = f"channel {cn}"
-            print_skip_warning(exc, cn)
+        if data.get(name, getclass=True) is not h5py.Group:
+            # not a channel group, creating the channel fails right away and issues the skip warning
+            chan = LazyChannel(name, SFChannel, data[name])
+            if chan.resolve() is None:
+                continue
         else:
-            channels[name] = chan
+            # only check that the needed datasets exist, channels are created on first access
+            try:
+                check_channel_group(name, data)
+            except Exception as exc:
+                cn = enquote(name)
+                print_skip_warning(exc, f"channel {cn}")
+                continue
+            chan = LazyChannel(name, load_channel, data)
+        channels[name] = chan
 
     if not channels:
         raise NoUsableChannelError(fname)
@@ -114,4 +134,43 @@ def load_from_generic_file(fname):
     return h5, channels
 
 
+def check_channel_group(name, data):
+    """Check that the group name has the datasets required by SFChannel via link lookups, i.e., without opening them"""
+    group = data[name]
+    for dn in (NAME_CHAN_DATA, NAME_CHAN_PIDS):
+        if group.get(dn, getlink=True) is None:
+            raise DatasetNotInGroupError(dn, group)
+
+def load_channel(name, data):
+    group = data[name]
+    return SFChannel(name, group)
+
+def load_indexed_channel(name, data, index):
+    chan = SFChannel(name, data[name], info=index.channels[name])
+    chan._raw_pids = index.get_pids(name)
+    return chan
+
+
+def build_index(fname, channels):
+    """
+    Create the index from the (lazy) channels of a generic file and store it in the sidecar file,
+    files read via jungfrau_utils are not indexed and None is returned
+    """
+    if not all(isinstance(ch, LazyChannel) for ch in channels.values()):
+        return None
+
+    usable = (ch.resolve() for ch in channels.values())
+    usable = (ch for ch in usable if ch is not None)
+    index = FileIndex.from_channels(fname, usable)
+
+    index_fname = get_index_filename(fname)
+    try:
+        index.save(index_fname)
+    except OSError as exc:
+        fn = enquote(index_fname)
+        warn(f"Could not write index file {fn} since it caused {typename(exc)}: {exc}", stacklevel=2)
+
+    return index
+
+
 
@@ -1,22 +1,31 @@
+import os
 from glob import glob
 from warnings import warn
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from .errors import NoMatchingFileError
 from .utils import typename, enquote, printable_string_sequence, print_skip_warning, FileContext
 from .sfdata import SFData
 from .sfdatafile import SFDataFile
+from .sfchannelconcat import SFChannelConcat
+from .lazychannel import LazyChannel
 from .sfmeta import SFMeta
 from .ign import remove_ignored_filetypes_run
 
 
+WARM_UP_BYTES = 4 * 1024**2 # superblock and root group metadata are at the beginning of hdf5 files
+
+
 class SFDataFiles(FileContext, SFData):
 
-    def __init__(self, *patterns):
+    def __init__(self, *patterns, workers=None, index=False, profile=None, follow=False, concat=False):
         super().__init__()
         self.fnames = []
         self.files = []
         self.meta = None
-        self.load(*patterns)
+        self.load(*patterns, workers=workers, index=index, profile=profile, follow=follow, concat=concat)
 
 
     def close(self):
@@ -32,16 +41,19 @@ class SFDataFiles(FileContext, SFData):
         return f"{tn}({fns}): {entries} channels"
 
 
-    def load(self, *patterns): #TODO: check if fnames/file already in self.fnames/self.files?
+    def load(self, *patterns, workers=None, index=False, profile=None, follow=False, concat=False): #TODO: check if fnames/file already in self.fnames/self.files?
         fnames = explode_filenames(patterns)
-        fnames, files = load_files(fnames)
+        fnames, files = load_files(fnames, workers=workers, index=index, profile=profile, follow=follow, concat=concat)
 
         if not files:
             patterns = printable_string_sequence(patterns)
             raise NoMatchingFileError(patterns, ftype="hdf5")
 
-        for f in files:
-            self.update(f)
+        if concat:
+            self.update(concat_channels(files))
+        else:
+            for f in files:
+                self.update(f)
 
         self.fnames.extend(fnames)
         self.files.extend(files)
@@ -66,23 +78,91 @@ def explode_filenames(patterns):
     return fnames
 
 
-def load_files(fnames):
+def load_files(fnames, workers=None, index=False, profile=None, follow=False, concat=False):
+    """
+    Open all fnames as SFDataFile skipping files that cannot be opened,
+    workers>0 warms up the files concurrently in a pool of threads before opening them (see open_files),
+    the results (masking of channels and warnings) are processed in the order of fnames either way
+    index=True uses (and creates if needed) the sidecar index of each file (see SFDataFile)
+    profile selects the h5py access profile (see sfdata.utils.profiles)
+    follow=True opens the files for reading while they are still being written (see SFDataFile)
+    concat=True does not warn about masked channels since they will be concatenated (see concat_channels)
+    """
     fnames = remove_ignored_filetypes_run(fnames)
     res = {}
-    for fn in fnames:
-        try:
-            f = SFDataFile(fn)
-        except Exception as exc:
+    for fn, (f, exc) in zip(fnames, open_files(fnames, workers, index, profile, follow)):
+        if exc is not None:
             quoted_fn = enquote(fn)
             print_skip_warning(exc, quoted_fn)
         else:
-            warn_masked_channels(fn, f, res)
+            if not concat:
+                warn_masked_channels(fn, f, res)
             res[fn] = f
 
     fnames, files = dict_to_tuples(res)
     return fnames, files
 
 
+def open_files(fnames, workers=None, index=False, profile=None, follow=False):
+    """
+    Open fnames one after the other since h5py holds a global lock while opening a file,
+    workers>0 warms up the files (see warm_up_file) concurrently in a pool of threads,
+    each file is opened as soon as it is warm while the following ones are still warming up
+    """
+    open_file = partial(try_open_file, index=index, profile=profile, follow=follow)
+    if not workers or len(fnames) < 2:
+        return map(open_file, fnames) # lazy, i.e., each file is processed right after opening it
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        warm = pool.map(warm_up_file, fnames) # in order of fnames
+        return [open_file(fn) for fn, _ in zip(fnames, warm)]
+
+
+def warm_up_file(fname, nbytes=WARM_UP_BYTES):
+    """
+    Read the beginning of fname into the page cache (plain file reads, which do not hold the h5py lock),
+    errors are ignored since they are reported when opening the file
+    """
+    try:
+        with open(fname, "rb", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            f.read(min(size, nbytes))
+    except OSError:
+        pass
+
+
+def try_open_file(fname, index=False, profile=None, follow=False):
+    """Open fname as SFDataFile, returns the file and None or None and the exception that occurred"""
+    try:
+        return SFDataFile(fname, index=index, profile=profile, follow=follow), None
+    except Exception as exc:
+        return None, exc
+
+
+def concat_channels(files):
+    """
+    Combine same-named channels from files into one SFChannelConcat each (in the order of files),
+    channels that occur only once are used as is, all channels stay lazy until first access
+    """
+    parts = defaultdict(list)
+    for f in files:
+        for name, entry in dict.items(f): # do not create lazy channels here
+            parts[name].append(entry)
+
+    res = {}
+    for name, entries in parts.items():
+        if len(entries) == 1:
+            res[name] = entries[0]
+        else:
+            res[name] = LazyChannel(name, load_concat_channel, entries)
+    return res
+
+
+def load_concat_channel(name, entries):
+    chans = (e.resolve() if isinstance(e, LazyChannel) else e for e in entries)
+    chans = [c for c in chans if c is not None]
+    return SFChannelConcat(name, chans)
+
+
 def dict_to_tuples(d):
     keys   = d.keys()
     values = d.values()
@@ -1,9 +1,15 @@
+import os
+from copy import deepcopy
 import h5py
+import numpy as np
 
 from .errors import ArrayLengthMismatch
-from .utils import typename, enquote, FileContext, FileStatus
+from .utils import typename, enquote, FileContext, FileStatus, ConcatDataset, BackgroundWriter, get_profile_kwargs
+from .utils.bgwriter import DEFAULT_QUEUE_SIZE
+from .utils.readplan import indices_to_runs, as_sorted_indices
 from .sfdata import SFData
 from .sfchannel import SFChannel
+from .sfchannelwriter import SFChannelWriter
 
 from .sfdatafile import NAME_FILE_META, NAME_FILE_DATA_ROOT
 from .sfchannel import NAME_CHAN_DATA, NAME_CHAN_PIDS, NAME_CHAN_TIMESTAMPS, NAME_CHAN_META
@@ -13,8 +19,16 @@ ALLOWED_MODES = ("w", "w-", "x")
 
 
 class SFProcFile(FileContext, SFData):
-
-    def __init__(self, fname, *args, mode="x", **kwargs):
+    """
+    background=True hands all writes to a dedicated writer thread via a queue of up to queue_size pending writes,
+    add_channel(), add_meta_entry() and the channel writers return right away (unless the queue is full),
+    the written arrays are copied such that they can be reused right away.
+    In this case, add_channel() and add_meta_entry() return None instead of the created channel/dataset,
+    which can be retrieved via self[name] (waits for the pending writes) or self.meta[name] after flush().
+    Exceptions from writing are re-raised by the next write, flush() or close().
+    """
+
+    def __init__(self, fname, *args, mode="x", profile=None, background=False, queue_size=DEFAULT_QUEUE_SIZE, **kwargs):
         if mode not in ALLOWED_MODES:
             allowed = ", ".join(ALLOWED_MODES)
             raise ValueError(f"Invalid mode; must be one of {allowed}")
@@ -22,9 +36,12 @@ class SFProcFile(FileContext, SFData):
         super().__init__()
         self.fname = fname
         self.fs = FileStatus(fname)
+        kwargs = {**get_profile_kwargs(profile), **kwargs} # explicit kwargs take precedence
         self.file = h5py.File(fname, *args, mode=mode, **kwargs)
         self._data = None
         self._meta = None
+        self._writers = []
+        self._bg = BackgroundWriter(queue_size) if background else None
 
 
     @property
@@ -44,7 +61,47 @@ class SFProcFile(FileContext, SFData):
         return self.file.attrs
 
     def close(self):
-        self.file.close()
+        try:
+            self.close_writers()
+        finally:
+            try:
+                self._close_background()
+            finally:
+                self.file.close()
+
+    def _close_background(self):
+        bg = self._bg
+        if bg is None:
+            return
+        self._bg = None
+        bg.close()
+
+    def flush(self):
+        """Wait for all pending background writes and flush the file"""
+        self._wait()
+        self.file.flush()
+
+    def _wait(self):
+        if self._bg is not None:
+            self._bg.flush()
+
+    def _submit(self, func, *args):
+        if self._bg is None:
+            return func(*args)
+        self._bg.submit(func, *args)
+
+    def close_writers(self):
+        """Close all open channel writers, the first length mismatch is raised after all writers have been closed"""
+        writers = self._writers
+        self._writers = []
+        error = None
+        for w in writers:
+            try:
+                w.close()
+            except ArrayLengthMismatch as exc:
+                error = error or exc
+        if error is not None:
+            raise error
 
     def __repr__(self):
         tn = typename(self)
@@ -52,7 +109,21 @@ class SFProcFile(FileContext, SFData):
         entries = len(self)
         return f"{tn}({fn}): {entries} channels"
 
+    @property
+    def names(self):
+        self._wait()
+        return super().names
+
+    def items(self): # also used by values()
+        self._wait()
+        return super().items()
+
+    def __contains__(self, name):
+        self._wait()
+        return super().__contains__(name)
+
     def __len__(self):
+        self._wait()
         data = self._data
         if data is None:
             return 0
@@ -60,6 +131,7 @@ class SFProcFile(FileContext, SFData):
 
 
     def __getitem__(self, name):
+        self._wait()
         data = self._data
         if data is None:
             msg = f"Unable to open object (object '{name}' doesn't exist)"
@@ -84,7 +156,13 @@ class SFProcFile(FileContext, SFData):
         if npids != ndata:
             raise ArrayLengthMismatch(name, npids, ndata)
 
-        group = self.data.create_group(name)
+        if self._bg is not None: # the write happens later
+            pids, data = np.array(pids), np.array(data)
+
+        return self._submit(self._add_channel, self.data, name, pids, data)
+
+    def _add_channel(self, parent, name, pids, data):
+        group = parent.create_group(name)
         group.create_dataset(NAME_CHAN_PIDS, data=pids)
         group.create_dataset(NAME_CHAN_DATA, data=data)
 
@@ -93,6 +171,25 @@ class SFProcFile(FileContext, SFData):
         return chan
 
 
+    def create_channel(self, name, shape=None, dtype=None, compression=None, workers=None):
+        """
+        Create a channel that is written piece by piece via the returned SFChannelWriter,
+        shape (of one entry) and dtype are taken from the first appended data unless given.
+        compression="bitshuffle" compresses the data in a pool of worker threads and writes whole chunks directly.
+        The channel is added once the writer is closed, which happens at the latest when this file is closed.
+        """
+        group = self.data.create_group(name)
+        bg = self._bg
+        submit, submit_always = (bg.submit, bg.submit_always) if bg is not None else (None, None)
+        writer = SFChannelWriter(name, group, shape=shape, dtype=dtype, compression=compression, workers=workers, on_close=self._add_written_channel, submit=submit, submit_always=submit_always)
+        self._writers.append(writer)
+        return writer
+
+    def _add_written_channel(self, name, group):
+        chan = SFChannel(name, group)
+        super().__setitem__(name, chan)
+
+
     def add_channels(self, *args, **kwargs):
         """
         accepts either
@@ -105,8 +202,52 @@ class SFProcFile(FileContext, SFData):
             self.add_channel(name, *values)
 
 
+    def add_virtual_channel(self, chan, name=None):
+        """
+        Add chan (an SFChannel) as virtual datasets that point at the datasets of chan, i.e., without copying the data.
+        Only the valid entries are included, each contiguous run of valid indices is mapped as one hyperslab,
+        thus, valid needs to be a boolean mask or sorted unique indices (otherwise a ValueError is raised).
+        The pulse IDs are copied instead if chan has an offset (since the offset needs to be applied to them).
+        Note that HDF5 opens the original files with the write intent of this file when reading the virtual datasets,
+        which fails (depending on the HDF5 version with an error or silently with fill values) while they are open elsewhere,
+        thus, no channel is created here. The virtual channels can be read via SFDataFile once this file has been closed.
+        """
+        name = name or chan.name
+        indices = as_sorted_indices(chan._get_valid_indices(), chan.ntotal)
+        if indices is None:
+            cn = enquote(chan.name)
+            raise ValueError(f"cannot map valid entries of channel {cn} that are not sorted unique indices or a boolean mask")
+        starts, stops = indices_to_runs(indices)
+
+        # create all layouts first such that unsupported datasets do not leave an incomplete group behind
+        layouts = {NAME_CHAN_DATA: make_virtual_layout(chan.datasets.data, starts, stops)}
+        if not chan.offset:
+            layouts[NAME_CHAN_PIDS] = make_virtual_layout(chan.datasets.pids, starts, stops)
+        timestamps = chan.datasets.timestamps
+        if timestamps is not None:
+            layouts[NAME_CHAN_TIMESTAMPS] = make_virtual_layout(timestamps, starts, stops)
+
+        group = self.data.create_group(name)
+
+        if chan.offset:
+            group.create_dataset(NAME_CHAN_PIDS, data=chan.pids)
+
+        for dn, layout in layouts.items():
+            group.create_virtual_dataset(dn, layout)
+
+
+    def add_virtual_channels(self, *chans):
+        for chan in chans:
+            self.add_virtual_channel(chan)
+
+
     def add_meta_entry(self, name, value):
-        return self.meta.create_dataset(name, data=value)
+        if self._bg is not None: # the write happens later
+            value = deepcopy(value)
+        return self._submit(self._add_meta_entry, self.meta, name, value)
+
+    def _add_meta_entry(self, parent, name, value):
+        return parent.create_dataset(name, data=value)
 
 
     def add_meta_entries(self, *args, **kwargs):
@@ -123,6 +264,51 @@ class SFProcFile(FileContext, SFData):
 
 
 
+def make_virtual_layout(dataset, starts, stops):
+    """
+    Virtual layout that maps the runs [start, stop) of dataset (along the first axis) one after the other,
+    runs that span across the parts of a ConcatDataset are split at the part boundaries
+    """
+    sources = get_virtual_sources(dataset)
+    part_offsets = np.array([offset for offset, _source in sources] + [dataset.shape[0]])
+
+    nentries = int(np.sum(stops - starts))
+    layout = h5py.VirtualLayout(shape=(nentries, *dataset.shape[1:]), dtype=dataset.dtype)
+
+    pos = 0
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        while start < stop:
+            ipart = np.searchsorted(part_offsets, start, side="right") - 1
+            offset, source = sources[ipart]
+            part_stop = min(stop, part_offsets[ipart + 1])
+            n = part_stop - start
+            layout[pos:pos+n] = source[start-offset:part_stop-offset]
+            pos += n
+            start = part_stop
+
+    return layout
+
+
+def get_virtual_sources(dataset):
+    """List of (offset along the first axis, VirtualSource) for dataset or the parts of a ConcatDataset"""
+    if isinstance(dataset, ConcatDataset):
+        offsets = dataset.offsets[:-1].tolist()
+        parts = dataset.parts
+    else:
+        offsets = [0]
+        parts = [dataset]
+
+    sources = []
+    for offset, part in zip(offsets, parts):
+        if not isinstance(part, h5py.Dataset):
+            tn = typename(part)
+            raise TypeError(f"cannot create virtual dataset from {tn}")
+        fname = os.path.abspath(part.file.filename) # the virtual file might be moved elsewhere
+        source = h5py.VirtualSource(fname, part.name, shape=part.shape, dtype=part.dtype)
+        sources.append((offset, source))
+    return sources
+
+
 def parse_1_args(funcname, args, kwargs):
     nargs = len(args)
     if nargs == 0:
@@ -168,9 +354,8 @@ def stack_dicts(a, b):
 #- add SFProcFile.add_attribute() / .add_attributes() for consistency?
 #- allow mode="a" ?
 #  would need to read file's existing channels
-#- allow appending/changing ch.pids/ch.data ?
+#- allow changing ch.pids/ch.data ?
 #  would need different SFChannel
-#  how to assert same length?
 
 
 
@@ -1,14 +1,28 @@
+from collections import deque, namedtuple
 from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+import multiprocessing as mp
+import pickle
+import numpy as np
+import xarray as xr
 from .errors import NoUsableFileError
 from .utils import typename, enquote, adjust_shape, json_load, print_skip_warning, FileStatus
 from .sfdatafiles import SFDataFiles
 from .ign import remove_ignored_filetypes_scan
 
 
+MP_CONTEXT = "spawn" # hdf5 is not fork-safe, thus, workers start fresh and open the files themselves
+
+ScanBatch = namedtuple("ScanBatch", ["step", "value", "readback", "pids", "data"])
+
+
 class SFScanInfo(Sequence):
 
-    def __init__(self, fname):
+    def __init__(self, fname, prefetch=0, profile=None):
         self.fname = fname
+        self.prefetch = prefetch # number of steps opened ahead in the background while iterating
+        self.profile = profile   # h5py access profile for opening the steps (see sfdata.utils.profiles)
         self.fs = FileStatus(fname)
         self.info = info = json_load(fname)
 
@@ -24,18 +38,78 @@ class SFScanInfo(Sequence):
 
     def __iter__(self):
 #        return (SFDataFiles(*fns) for fns in self.files) #TODO: errors stop the iteration. do we want this?
-        return generate_sfdata(self.files)
+        return generate_sfdata(self.files, prefetch=self.prefetch, profile=self.profile)
 
     def __getitem__(self, index):
         fns = self.files[index]
         if isinstance(index, slice):
-            return generate_sfdata(fns)
-        return SFDataFiles(*fns)
+            return generate_sfdata(fns, prefetch=self.prefetch, profile=self.profile)
+        return SFDataFiles(*fns, profile=self.profile)
 
     def __len__(self):
         return len(self.files)
 
 
+    def in_batches(self, channel, size=100, aligned=False, prefetch=0):
+        """
+        Iterate over channel across all steps in order in batches of (at most) size entries,
+        each batch is a ScanBatch(step, value, readback, pids, data) and belongs to a single step.
+        Steps that cannot be opened or do not contain channel are skipped with a warning.
+        value and readback are None for steps that are not (yet) listed in the scan info, e.g., while the scan is still running.
+        aligned and prefetch are passed on to SFChannel.in_batches,
+        the steps themselves are opened ahead in the background according to the prefetch attribute.
+        """
+        steps = generate_indexed_sfdata(self.files, prefetch=self.prefetch, profile=self.profile)
+        try:
+            for i, data in steps:
+                try:
+                    chan = data[channel]
+                except KeyError as exc:
+                    sn = f"step {i}"
+                    print_skip_warning(exc, sn)
+                    continue
+                value = get_step_entry(self.values, i)
+                readback = get_step_entry(self.readbacks, i)
+                pids = chan.pids
+                for index_slice, batch in chan.in_batches(size=size, aligned=aligned, prefetch=prefetch):
+                    yield ScanBatch(i, value, readback, pids[index_slice], batch)
+        finally:
+            steps.close()
+
+
+    def map(self, func, workers=None):
+        """
+        Apply func to each step (an SFDataFiles object) and collect the results into a DataArray indexed by step,
+        with values and readbacks as coordinates along the step axis.
+        Steps that cannot be opened or for which func fails are skipped with a warning and marked as NaN.
+        workers>0 distributes the steps over a pool of worker processes,
+        func then needs to be picklable, i.e., defined at the top level of a module (no lambdas or closures).
+        """
+        fnames = remove_ignored_filetypes_scan(self.files)
+        results = map_steps(func, fnames, workers=workers, profile=self.profile)
+
+        nsteps = len(fnames)
+        res = None
+        for i, (fns, (step_res, exc)) in enumerate(zip(fnames, results)):
+            if exc is not None:
+                sn = f"step {i} {fns}"
+                print_skip_warning(exc, sn)
+                continue
+            step_res = np.asarray(step_res)
+            if res is None:
+                res = np.full((nsteps, *step_res.shape), np.nan, dtype=np.result_type(step_res, float)) # e.g., complex results are kept
+            res[i] = step_res
+
+        if res is None:
+            raise NoUsableFileError
+
+        coords = {"step": np.arange(nsteps)}
+        coords.update(make_step_coords("values", self.values, nsteps))
+        coords.update(make_step_coords("readbacks", self.readbacks, nsteps))
+        dims = ["step"] + [f"_dim{i}" for i in range(1, res.ndim)]
+        return xr.DataArray(res, coords=coords, dims=dims)
+
+
     def __repr__(self):
         tn = typename(self)
         fn = enquote(self.fname)
@@ -44,19 +118,117 @@ class SFScanInfo(Sequence):
 
 
 
-def generate_sfdata(fnames):
+def generate_sfdata(fnames, prefetch=0, profile=None):
+    steps = generate_indexed_sfdata(fnames, prefetch=prefetch, profile=profile)
+    try:
+        for _i, data in steps:
+            yield data
+    finally:
+        steps.close()
+
+
+def generate_indexed_sfdata(fnames, prefetch=0, profile=None):
+    """Open the steps one after the other skipping those that cannot be opened, yields (step index, step) tuples"""
     fnames = remove_ignored_filetypes_scan(fnames)
+    steps = prefetched_steps(fnames, prefetch, profile=profile) if prefetch else lazy_steps(fnames, profile=profile)
     nothing_opened = True
-    for i, fns in enumerate(fnames):
-        try:
-            with SFDataFiles(*fns) as data: #TODO: is this what we want? does it even work? maybe explict .close() after yield is better?
-                yield data
-            nothing_opened = False
-        except Exception as exc:
-            sn = f"step {i} {fns}"
-            print_skip_warning(exc, sn)
+    try:
+        for i, (fns, open_step) in enumerate(zip(fnames, steps)):
+            try:
+                with open_step() as data: #TODO: is this what we want? does it even work? maybe explict .close() after yield is better?
+                    yield i, data
+                nothing_opened = False
+            except Exception as exc:
+                sn = f"step {i} {fns}"
+                print_skip_warning(exc, sn)
+    finally:
+        steps.close() # closes steps that were opened ahead but not used
     if nothing_opened:
         raise NoUsableFileError
 
 
+def map_steps(func, fnames, workers=None, profile=None):
+    """Apply func to each step in fnames, returns a (result, None) or (None, exception) tuple per step"""
+    if not workers:
+        apply = partial(apply_to_step, func, profile=profile)
+        return [apply(fns) for fns in fnames]
+    apply = partial(apply_to_step_in_worker, func, profile=profile)
+    ctx = mp.get_context(MP_CONTEXT)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        return list(pool.map(apply, fnames))
+
+
+def apply_to_step(func, fns, profile=None):
+    try:
+        with SFDataFiles(*fns, profile=profile) as data:
+            return func(data), None
+    except Exception as exc:
+        return None, exc
+
+
+def apply_to_step_in_worker(func, fns, profile=None):
+    res, exc = apply_to_step(func, fns, profile=profile)
+    if exc is not None:
+        exc = make_picklable(exc)
+    return res, exc
+
+
+def make_picklable(exc):
+    """Exceptions are sent back from the workers pickled, replace those that cannot be restored by a RuntimeError with the same message"""
+    try:
+        pickle.loads(pickle.dumps(exc))
+    except Exception:
+        excname = typename(exc)
+        return RuntimeError(f"{excname}: {exc}")
+    return exc
+
+
+def get_step_entry(arr, i):
+    """Entry of arr for step i, or None if arr is shorter (e.g., scan info of a scan that is still running)"""
+    if i >= len(arr):
+        return None
+    return arr[i]
+
+
+def make_step_coords(name, arr, nsteps):
+    """Coordinates along the step axis for arr, one per column if arr has several columns (i.e., several scan parameters)"""
+    if len(arr) != nsteps: # e.g., scan info of a scan that is still running
+        return {}
+    if arr.ndim == 1:
+        return {name: ("step", arr)}
+    columns = arr.reshape(nsteps, -1).T
+    return {f"{name}_{i}": ("step", col) for i, col in enumerate(columns)}
+
+
+def lazy_steps(fnames, profile=None):
+    for fns in fnames:
+        yield partial(SFDataFiles, *fns, profile=profile)
+
+
+def prefetched_steps(fnames, n, profile=None):
+    """
+    Open the steps in a pool of n threads such that up to n steps are opened ahead of the current one,
+    yields for each step a callable that returns the opened step (or raises the exception that occurred while opening)
+    """
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        futures = deque()
+        try:
+            for fns in fnames:
+                futures.append(pool.submit(SFDataFiles, *fns, profile=profile))
+                if len(futures) > n:
+                    yield futures.popleft().result
+            while futures:
+                yield futures.popleft().result
+        finally:
+            for fut in futures:
+                close_opened_step(fut)
+
+
+def close_opened_step(future):
+    if future.cancel(): # not started yet
+        return
+    if future.exception() is None: # waits for the step to be opened
+        future.result().close()
+
+
 
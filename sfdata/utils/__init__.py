@@ -1,15 +1,24 @@
 
 from .utils import typename
 from .batching import apply_batched, batched
+from .bgwriter import BackgroundWriter
+from .bshuf import DirectChunkDataset, DirectChunkWriter, get_bshuf_kwargs, is_direct_readable
 from .closedh5 import ClosedH5, ClosedH5Error
+from .concat import ConcatDataset
 from .cprint import cprint, ncprint
 from .fdemux import FileDemultiplexer
 from .filecontext import FileContext
+from .fileindex import FileIndex, load_index, get_index_filename
 from .filestatus import FileStatus
-from .h5 import h5_boolean_indexing
+from .h5 import h5_boolean_indexing, get_chunk_shape
 from .json import json_load
+from .mmap import get_memmap
 from .np import adjust_shape
 from .pd import decide_pandas_dtype
+from .pidalignment import PIDAlignment
+from .pidranges import PIDRanges
+from .profiles import get_profile_kwargs, get_open_kwargs, open_h5_with_profile
+from .readplan import read_valid
 from .progress import dip, percentage_missing, decide_color
 from .strprint import strlen, maxstrlen, print_line, printable_string_sequence, enquote
 from .warn import print_skip_warning
@@ -1,28 +1,66 @@
+import os
+import mmap
+import tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import h5py
 import numpy as np
 from .np import adjust_shape, nothing_like
+from .readplan import read_valid, is_plannable
+from .prefetch import prefetched
+from .profiles import get_open_kwargs, open_h5_with_profile
 
 
-def apply_batched(func, dataset, indices, batch_size, nbatches=None):
+MP_CONTEXT = "spawn" # hdf5 is not fork-safe, thus, workers start fresh and reopen the file
+
+
+def apply_batched(func, dataset, indices, batch_size, nbatches=None, aligned=False, prefetch=0, workers=None, read_dtype=None, dtype=None, out=None):
     """
     Iterate over dataset[indices] in batches of batch_size length
     and apply func to each batch collecting the results in a numpy array
     limit the result to nbatches batches, the default nbatches=None means all batches
+    aligned=True puts the batch edges onto chunk boundaries (see batch_slices)
+    prefetch>0 reads up to prefetch batches ahead in a background thread
+    workers>0 distributes the batches over a pool of worker processes (see apply_batched_in_processes)
+    read_dtype converts the batches while reading (see read_valid)
+    the results have the dtype of the result for the first batch unless dtype is given,
+    and are written into out (e.g., an np.memmap) if given, which needs to have the shape of the result
     """
     if batch_size == 0 or nbatches == 0:
-        return nothing_like(dataset)
+        return nothing_like_result(dataset, dtype, out)
+
+    indices = np.asanyarray(indices)
+    slices = batch_slices(dataset, indices, batch_size, nbatches=nbatches, aligned=aligned)
+    if not slices:
+        return nothing_like_result(dataset, dtype, out)
+
+    use_processes = workers and isinstance(dataset, h5py.Dataset)
+    if use_processes:
+        prefetch = 0 # the first batch is read directly
 
-    batches = batched(dataset, indices, batch_size, nbatches=nbatches)
+    batches = iter_batches(dataset, indices, slices, read_dtype)
+    batches = prefetched(batches, prefetch)
     first_indices, first_batch = next(batches)
-    first_batch_res = func(first_batch)
+    first_batch_res = np.asanyarray(func(first_batch))
 
-    ntotal = len(indices)
-    if nbatches is not None:
-        ntotal_batched = nbatches * batch_size
-        ntotal = min(ntotal, ntotal_batched)
+    ntotal = slices[-1].stop
+    ntotal = min(ntotal, len(indices))
 
     single_res_shape = first_batch_res[0].shape
     res_shape = (ntotal, *single_res_shape)
-    res = np.empty(res_shape)
+
+    if dtype is None:
+        dtype = decide_result_dtype(first_batch_res)
+
+    if out is not None and out.shape != res_shape:
+        batches.close()
+        raise ValueError(f"output array has shape {out.shape} but the result has shape {res_shape}")
+
+    if use_processes:
+        batches.close()
+        return apply_batched_in_processes(func, dataset, indices, slices[1:], first_indices, first_batch_res, res_shape, workers, read_dtype, dtype, out)
+
+    res = np.empty(res_shape, dtype=dtype) if out is None else out
 
     res[first_indices] = first_batch_res
     for indices, batch in batches:
@@ -30,35 +68,202 @@ def apply_batched(func, dataset, indices, batch_size, nbatches=None):
     return res
 
 
-def batched(dataset, indices, batch_size, nbatches=None):
+def apply_batched_in_processes(func, dataset, indices, slices, first_indices, first_batch_res, res_shape, workers, read_dtype=None, dtype=float, out=None):
+    """
+    Apply func to the batches dataset[indices[index_slice]] for all slices in a pool of worker processes,
+    each worker reopens the file read-only (with the same cache settings and SWMR mode) and writes its results directly into a shared result array
+    at the right index_slice. If out is a file-backed np.memmap (see get_file_backing), the workers write into its file directly,
+    otherwise, the shared array is memory-mapped from a temporary file and the result is copied into out if given.
+    func needs to be picklable, i.e., defined at the top level of a module (no lambdas or closures).
+    """
+    if np.dtype(dtype).hasobject:
+        raise TypeError("results of object dtype cannot be collected from worker processes")
+
+    backing = get_file_backing(out)
+    if backing is not None:
+        shared = out
+        tmp_fname = None
+    else:
+        fd, tmp_fname = tempfile.mkstemp(suffix=".npy")
+        os.close(fd)
+
+    try:
+        if tmp_fname is not None:
+            shared = np.lib.format.open_memmap(tmp_fname, mode="w+", dtype=dtype, shape=res_shape)
+            backing = get_file_backing(shared)
+
+        shared[first_indices] = first_batch_res
+        shared.flush()
+
+        if slices:
+            ctx = mp.get_context(MP_CONTEXT)
+            res_spec = (*backing, shared.dtype, shared.shape)
+            initargs = (dataset.file.filename, dataset.name, func, res_spec, read_dtype, get_open_kwargs(dataset.file))
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_worker, initargs=initargs) as pool:
+                futures = [pool.submit(apply_batch_in_worker, indices[index_slice], index_slice) for index_slice in slices]
+                for fut in futures:
+                    fut.result() # re-raises exceptions from the workers
+
+        if shared is out:
+            return out # the workers wrote via their own (shared) mappings of the same file
+
+        if out is None:
+            res = np.array(shared)
+        else:
+            res = out
+            res[:] = shared
+        del shared
+        return res
+
+    finally:
+        if tmp_fname is not None:
+            os.remove(tmp_fname)
+
+
+def get_file_backing(arr):
+    """
+    File name and byte offset of arr if it is a whole (not sliced), writable, C-contiguous np.memmap,
+    i.e., if other processes can write into it by mapping the same part of the file, otherwise None
+    """
+    if not isinstance(arr, np.memmap) or not isinstance(arr.base, mmap.mmap):
+        return None
+    if arr.filename is None or arr.mode not in ("r+", "w+") or not arr.flags.c_contiguous:
+        return None
+    return arr.filename, arr.offset
+
+
+worker_state = {}
+
+def init_worker(fname, dataset_name, func, res_spec, read_dtype=None, open_kwargs=None):
+    h5 = open_h5_with_profile(fname, mode="r", profile=open_kwargs)
+    res_fname, res_offset, res_dtype, res_shape = res_spec
+    worker_state["h5"] = h5
+    worker_state["dataset"] = h5[dataset_name]
+    worker_state["func"] = func
+    worker_state["res"] = np.memmap(res_fname, mode="r+", dtype=res_dtype, shape=res_shape, offset=res_offset)
+    worker_state["read_dtype"] = read_dtype
+
+def apply_batch_in_worker(batch_indices, index_slice):
+    dataset = worker_state["dataset"]
+    func    = worker_state["func"]
+    res     = worker_state["res"]
+    read_dtype = worker_state["read_dtype"]
+    batch = read_batch(dataset, batch_indices, read_dtype)
+    batch = adjust_shape(batch)
+    res[index_slice] = func(batch)
+
+
+def batched(dataset, indices, batch_size, nbatches=None, aligned=False, prefetch=0, read_dtype=None):
     """
     Iterate over dataset[indices] in batches of batch_size length
     limit the result to nbatches batches, the default nbatches=None means all batches
+    aligned=True puts the batch edges onto chunk boundaries (see batch_slices)
+    prefetch>0 reads up to prefetch batches ahead in a background thread
+    read_dtype converts the batches while reading (see read_valid)
+    """
+    indices = np.asanyarray(indices) # see read_batch below
+    slices = batch_slices(dataset, indices, batch_size, nbatches=nbatches, aligned=aligned)
+    batches = iter_batches(dataset, indices, slices, read_dtype)
+    yield from prefetched(batches, prefetch)
+
+
+def iter_batches(dataset, indices, slices, read_dtype=None):
+    for index_slice in slices:
+        batch_indices = indices[index_slice]
+        batch_data = read_batch(dataset, batch_indices, read_dtype)
+        batch_data = adjust_shape(batch_data)
+        yield index_slice, batch_data
+
+
+def decide_result_dtype(first_batch_res):
+    """
+    dtype of the collected results given the result for the first batch,
+    strings and bytes are collected as objects since later results might be longer
+    """
+    dtype = first_batch_res.dtype
+    if dtype.kind in "SU":
+        return object
+    return dtype
+
+
+def nothing_like_result(dataset, dtype, out):
+    if out is not None:
+        return out
+    if dtype is not None:
+        return np.empty(0, dtype=dtype)
+    return nothing_like(dataset)
+
+
+def read_batch(dataset, batch_indices, read_dtype=None):
+    if is_plannable(dataset) or hasattr(dataset, "read_valid"):
+        return read_valid(dataset, batch_indices, dtype=read_dtype)
+
+    # this assumes indices is sorted (otherwise min/max)
+    start = batch_indices[0]
+    stop  = batch_indices[-1] + 1
+
+    slice_batch = slice(start, stop)
+    indices_in_batch = batch_indices - start # indices has to be numpy array for this to work
+
+    res = dataset[slice_batch][indices_in_batch]
+    if read_dtype is not None:
+        res = res.astype(read_dtype, copy=False)
+    return res
+
+
+def batch_slices(dataset, indices, batch_size, nbatches=None, aligned=False):
+    """
+    Split indices into batches of batch_size length, returns a list of slices into indices
+    limit the result to nbatches batches, the default nbatches=None means all batches
+    aligned=True keeps all indices that belong to the same chunk of the dataset in the same batch
+    and collects whole chunks into batches of at most batch_size indices (but at least one chunk),
+    thus, each chunk is read (and decompressed) only once per pass.
+    For datasets that are not chunked, aligned has no effect.
     """
     if batch_size == 0 or nbatches == 0:
-        return
+        return []
 
     ntotal = len(indices)
-    batch_size = min(batch_size, ntotal)
+    if ntotal == 0:
+        return []
 
-    indices = np.asanyarray(indices) # see indices_in_batch below
-    for i in range(0, ntotal, batch_size):
-        if nbatches is not None and i >= nbatches * batch_size:
-            break
+    chunk_rows = get_chunk_rows(dataset) if aligned else None
+    if chunk_rows is None:
+        batch_size = min(batch_size, ntotal)
+        slices = [slice(i, i+batch_size) for i in range(0, ntotal, batch_size)]
+    else:
+        slices = chunk_aligned_slices(indices, batch_size, chunk_rows)
 
-        index_slice = slice(i, i+batch_size)
-        batch_indices = indices[index_slice]
+    if nbatches is not None:
+        slices = slices[:nbatches]
 
-        # this assumes indices is sorted (otherwise min/max)
-        start = batch_indices[0]
-        stop  = batch_indices[-1] + 1
+    return slices
 
-        slice_batch = slice(start, stop)
-        indices_in_batch = batch_indices - start # indices has to be numpy array for this to work
 
-        batch_data = dataset[slice_batch][indices_in_batch]
-        batch_data = adjust_shape(batch_data)
-        yield index_slice, batch_data
+def chunk_aligned_slices(indices, batch_size, chunk_rows):
+    # this assumes indices is sorted
+    chunk_indices = np.asarray(indices) // chunk_rows
+    breaks = np.flatnonzero(np.diff(chunk_indices)) + 1
+    starts = np.r_[0, breaks].tolist()
+    stops  = np.r_[breaks, len(indices)].tolist()
+
+    slices = []
+    batch_start = batch_stop = 0
+    for start, stop in zip(starts, stops):
+        if stop - batch_start > batch_size and batch_stop > batch_start:
+            slices.append(slice(batch_start, batch_stop))
+            batch_start = start
+        batch_stop = stop
+    slices.append(slice(batch_start, batch_stop))
+
+    return slices
+
+
+def get_chunk_rows(dataset):
+    chunks = getattr(dataset, "chunks", None)
+    if not chunks:
+        return None
+    return chunks[0]
 
 
 
@@ -0,0 +1,79 @@
+from queue import Queue
+from threading import Thread, Lock
+
+
+DEFAULT_QUEUE_SIZE = 8
+
+STOP = None # queue entry that ends the writer thread
+
+
+class BackgroundWriter:
+    """
+    Run write operations in submission order in a dedicated thread,
+    submit() blocks while queue_size operations are pending (backpressure).
+    The first exception raised by an operation is stored and re-raised by the next call to submit(), flush() or close(),
+    all operations that run in the meantime are dropped except for those handed to submit_always() (e.g., closing).
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue = Queue(maxsize=queue_size)
+        self._error = None
+        self._lock = Lock()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, func, *args, **kwargs):
+        self._raise_error()
+        self._put(func, args, kwargs, False)
+
+    def submit_always(self, func, *args, **kwargs):
+        """
+        Like submit() but the operation also runs if an earlier one failed,
+        the stored exception is not raised here (but by the next flush() or close())
+        """
+        self._put(func, args, kwargs, True)
+
+    def _put(self, func, args, kwargs, always):
+        if not self.thread.is_alive():
+            raise RuntimeError("cannot submit to closed background writer")
+        self.queue.put((func, args, kwargs, always))
+
+    def flush(self):
+        """Wait until all pending operations are done"""
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(STOP)
+            self.thread.join()
+        self._raise_error()
+
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                if entry is STOP:
+                    return
+                func, args, kwargs, always = entry
+                if self._error is not None and not always: # drop operations that were pending when an earlier one failed
+                    continue
+                try:
+                    func(*args, **kwargs)
+                except BaseException as exc:
+                    with self._lock:
+                        self._error = self._error or exc # keep the first exception
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        with self._lock:
+            exc = self._error
+            self._error = None
+        if exc is not None:
+            raise exc
+
+
+
@@ -0,0 +1,262 @@
+import os
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+import numpy as np
+import bitshuffle
+
+from .readplan import as_sorted_indices, is_plannable, as_output_buffer, fill_output_buffer
+
+
+# see https://github.com/kiyo-masui/bitshuffle/blob/master/src/bshuf_h5filter.h
+BSHUF_FILTER = 32008
+BSHUF_LZ4 = 2
+
+BSHUF_HEADER = struct.Struct(">QI") # uncompressed size in bytes, block size in bytes
+
+TARGET_BLOCK_BYTES = 8192
+BLOCKED_MULT = 8
+MIN_BLOCK_SIZE = 128
+
+
+def get_bshuf_kwargs():
+    """Keyword arguments for h5py create_dataset that set up the bitshuffle/LZ4 filter with automatic block size"""
+    return dict(compression=BSHUF_FILTER, compression_opts=(0, BSHUF_LZ4))
+
+
+def get_block_size(itemsize):
+    """Number of elements per block as chosen automatically by the bitshuffle filter"""
+    block_size = TARGET_BLOCK_BYTES // itemsize
+    block_size -= block_size % BLOCKED_MULT
+    return max(MIN_BLOCK_SIZE, block_size)
+
+
+def is_direct_readable(dataset):
+    """
+    Check whether dataset is compressed with bitshuffle/LZ4 as its only filter,
+    which is the only case that can be decompressed by decompress_chunk
+    """
+    if not is_plannable(dataset) or dataset.chunks is None:
+        return False
+    plist = dataset.id.get_create_plist()
+    if plist.get_nfilters() != 1:
+        return False
+    code, _flags, values, _name = plist.get_filter(0)
+    return code == BSHUF_FILTER and len(values) > 4 and values[4] == BSHUF_LZ4
+
+
+def compress_chunk(chunk):
+    """
+    Compress chunk with bitshuffle/LZ4 into the format written by the hdf5 filter,
+    i.e., the compressed blocks prefixed with a header holding the uncompressed size and the block size (both in bytes)
+    """
+    chunk = np.ascontiguousarray(chunk)
+    itemsize = chunk.dtype.itemsize
+    block_size = get_block_size(itemsize)
+    header = BSHUF_HEADER.pack(chunk.nbytes, block_size * itemsize)
+    compressed = bitshuffle.compress_lz4(chunk, block_size)
+    return header + compressed.tobytes()
+
+
+def decompress_chunk(raw, shape, dtype):
+    """Inverse of compress_chunk, i.e., decompress a chunk as read via read_direct_chunk"""
+    dtype = np.dtype(dtype)
+    _nbytes, block_bytes = BSHUF_HEADER.unpack_from(raw)
+    block_size = block_bytes // dtype.itemsize
+    compressed = np.frombuffer(raw, dtype=np.uint8, offset=BSHUF_HEADER.size)
+    return bitshuffle.decompress_lz4(compressed, shape, dtype, block_size)
+
+
+
+class DirectChunkWriter:
+    """
+    Append entries along the first axis of a chunked, resizable dataset that uses the bitshuffle/LZ4 filter,
+    whole chunks are compressed in a pool of worker threads and written in order via write_direct_chunk,
+    which bypasses the (single-threaded) filter pipeline of hdf5.
+    Entries are collected until a chunk is complete, the last incomplete chunk is written (zero-padded) by close().
+    """
+
+    def __init__(self, dataset, workers=None):
+        if dataset.shape[0] != 0:
+            raise ValueError("can only append to empty dataset")
+        self.dataset = dataset
+        self.chunks = dataset.chunks
+        if self.chunks[1:] != dataset.shape[1:]:
+            raise ValueError(f"chunks {self.chunks} need to span whole entries of shape {dataset.shape[1:]}")
+        self.rows = self.chunks[0]
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = deque() # (chunk index, future) in order
+        self.max_pending = 2 * (workers or os.cpu_count() or 1)
+        self.buffer = np.empty(self.chunks, dtype=dataset.dtype)
+        self.nbuffered = 0
+        self.nchunks = 0
+
+
+    def append(self, values):
+        values = np.asarray(values)
+        shape = self.dataset.shape[1:]
+        if values.shape[1:] != shape:
+            raise ValueError(f"cannot append entries of shape {values.shape[1:]} to dataset with entries of shape {shape}")
+
+        start = self.dataset.shape[0]
+        self.dataset.resize(start + len(values), axis=0)
+
+        rows = self.rows
+        while len(values):
+            if self.nbuffered == 0 and len(values) >= rows:
+                chunk, values = values[:rows], values[rows:]
+                self._submit(np.array(chunk, dtype=self.buffer.dtype)) # copy as the caller may reuse values while the chunk is still being compressed
+                continue
+            n = min(rows - self.nbuffered, len(values))
+            self.buffer[self.nbuffered:self.nbuffered+n] = values[:n]
+            self.nbuffered += n
+            values = values[n:]
+            if self.nbuffered == rows:
+                self._submit(self.buffer)
+                self.buffer = np.empty_like(self.buffer) # the submitted buffer is still being compressed
+                self.nbuffered = 0
+
+
+    def close(self):
+        try:
+            if self.nbuffered:
+                self.buffer[self.nbuffered:] = 0
+                self._submit(self.buffer)
+                self.nbuffered = 0
+            self._write_pending(0)
+        finally:
+            self.pool.shutdown()
+
+
+    def _submit(self, chunk):
+        fut = self.pool.submit(compress_chunk, chunk)
+        self.pending.append((self.nchunks, fut))
+        self.nchunks += 1
+        self._write_pending(self.max_pending)
+
+    def _write_pending(self, keep):
+        """Write the oldest compressed chunks until at most keep are still pending"""
+        ndim = len(self.chunks)
+        dsid = self.dataset.id
+        while len(self.pending) > keep:
+            index, fut = self.pending.popleft()
+            compressed = fut.result()
+            offset = (index * self.rows,) + (0,) * (ndim - 1)
+            dsid.write_direct_chunk(offset, compressed)
+
+
+
+class DirectChunkDataset:
+    """
+    Read-only view of a bitshuffle/LZ4-compressed hdf5 dataset (see is_direct_readable)
+    that reads the raw chunks via read_direct_chunk and decompresses them in a pool of worker threads
+    instead of one after the other in the filter pipeline of hdf5.
+    Only the chunks that hold requested entries are read, chunks that have not been written yield the fill value.
+    """
+
+    def __init__(self, dataset, workers=None):
+        self.dataset = dataset
+        self.workers = workers
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def ndim(self):
+        return self.dataset.ndim
+
+    @property
+    def size(self):
+        return self.dataset.size
+
+    @property
+    def chunks(self):
+        return self.dataset.chunks
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, key):
+        return self.dataset[key]
+
+
+    def read_valid(self, valid, out=None):
+        """
+        Read self[valid] for Ellipsis, a boolean mask or sorted unique indices,
+        anything else is read via the hdf5 filter pipeline,
+        if out is given, the result is written into it
+        """
+        ntotal = len(self)
+        if valid is Ellipsis:
+            indices = np.arange(ntotal)
+        else:
+            indices = as_sorted_indices(valid, ntotal)
+            if indices is None:
+                return fill_output_buffer(self.dataset[:][valid], out)
+
+        out_shape = (len(indices), *self.shape[1:])
+        if out is None:
+            res = out = np.empty(out_shape, dtype=self.dtype)
+        else:
+            res = out
+            out = as_output_buffer(out, out_shape)
+
+        if len(indices) == 0:
+            return res
+
+        chunk_rows = self.chunks[0]
+        chunk_indices = indices // chunk_rows
+        breaks = np.flatnonzero(np.diff(chunk_indices)) + 1
+        starts = np.r_[0, breaks].tolist()
+        stops  = np.r_[breaks, len(indices)].tolist()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self._read_chunk_row, indices[start:stop], out, start) for start, stop in zip(starts, stops)]
+            for fut in futures:
+                fut.result() # re-raises exceptions from the workers
+
+        return res
+
+
+    def _read_chunk_row(self, row_indices, out, pos):
+        """
+        Read all chunks (along all but the first axis) that hold the entries at row_indices (within the same chunk row),
+        and write these entries into out starting at pos
+        """
+        dataset = self.dataset
+        shape = dataset.shape
+        chunks = dataset.chunks
+        dtype = dataset.dtype
+
+        chunk_rows = chunks[0]
+        row_start = (row_indices[0] // chunk_rows) * chunk_rows
+        local = row_indices - row_start
+        dest = out[pos:pos+len(row_indices)]
+
+        dsid = dataset.id
+        ranges = [range(0, n, c) for n, c in zip(shape[1:], chunks[1:])]
+        for other_offsets in product(*ranges):
+            offset = (row_start, *other_offsets)
+            info = dsid.get_chunk_info_by_coord(offset)
+            if info.byte_offset is None: # chunk not written
+                chunk = np.full(chunks, dataset.fillvalue, dtype=dtype)
+            else:
+                filter_mask, raw = dsid.read_direct_chunk(offset)
+                if filter_mask & 1: # filter was skipped while writing
+                    chunk = np.frombuffer(raw, dtype=dtype).reshape(chunks)
+                else:
+                    chunk = decompress_chunk(raw, chunks, dtype)
+
+            # edge chunks are padded
+            sel = tuple(slice(o, min(o + c, n)) for o, c, n in zip(other_offsets, chunks[1:], shape[1:]))
+            chunk_sel = tuple(slice(0, s.stop - s.start) for s in sel)
+            dest[(slice(None), *sel)] = chunk[(local, *chunk_sel)]
+
+
+
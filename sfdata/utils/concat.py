@@ -0,0 +1,126 @@
+import numpy as np
+
+from .readplan import read_valid, as_output_buffer, fill_output_buffer
+
+
+class ConcatDataset:
+    """
+    Read-only concatenation of several datasets along the first axis without copying,
+    reads are routed to the part(s) that hold the requested index range.
+    The parts are given as a callable returning the current list of datasets,
+    such that closed files are reported by the parts themselves.
+    """
+
+    def __init__(self, get_parts):
+        self._get_parts = get_parts
+
+    @property
+    def parts(self):
+        return self._get_parts()
+
+    @property
+    def offsets(self):
+        """Index of the first entry of each part, and the total length as last entry"""
+        lengths = [p.shape[0] for p in self.parts]
+        return np.r_[0, np.cumsum(lengths)].astype(np.int64)
+
+    @property
+    def shape(self):
+        parts = self.parts
+        ntotal = sum(p.shape[0] for p in parts)
+        return (ntotal, *parts[0].shape[1:])
+
+    @property
+    def dtype(self):
+        return self.parts[0].dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def chunks(self):
+        return None # chunk boundaries differ between the parts
+
+    def __len__(self):
+        return self.shape[0]
+
+    def refresh(self):
+        for p in self.parts:
+            refresh = getattr(p, "refresh", None)
+            if refresh is not None:
+                refresh()
+
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, *rest = key
+
+        ntotal = len(self)
+        if isinstance(first, (int, np.integer)):
+            index = int(first)
+            if index < 0:
+                index += ntotal
+            if not 0 <= index < ntotal:
+                raise IndexError(f"index {first} is out of bounds for axis 0 with size {ntotal}")
+            res = self.read_valid([index])[0]
+            return res[tuple(rest)] if rest else res
+
+        indices = np.arange(ntotal)[first] # also handles slices and boolean masks
+        res = self.read_valid(indices)
+        return res[(slice(None), *rest)] if rest else res
+
+    def read_valid(self, valid, out=None):
+        """
+        Read self[valid] for Ellipsis, a boolean mask or indices,
+        each part is read via read_valid with the indices that fall into its range,
+        if out is given, the parts are read directly into it (unless the indices need reordering)
+        """
+        ntotal = len(self)
+        if valid is Ellipsis:
+            indices = np.arange(ntotal)
+        else:
+            indices = np.asarray(valid)
+            if indices.dtype == bool:
+                indices = np.flatnonzero(indices)
+            indices = np.where(indices < 0, indices + ntotal, indices)
+
+        unique, inverse = np.unique(indices, return_inverse=True)
+        if len(unique) and (unique[0] < 0 or unique[-1] >= ntotal):
+            raise IndexError(f"indices are out of bounds for axis 0 with size {ntotal}")
+
+        parts = self.parts
+        offsets = self.offsets
+        bounds = np.searchsorted(unique, offsets)
+        in_order = len(unique) == len(indices) and np.array_equal(unique, indices)
+
+        if out is not None and in_order:
+            dest = as_output_buffer(out, (len(indices), *self.shape[1:]))
+            for part, offset, first, last in zip(parts, offsets, bounds[:-1], bounds[1:]):
+                if first != last:
+                    read_valid(part, unique[first:last] - offset, out=dest[first:last])
+            return out
+
+        res = []
+        for part, offset, first, last in zip(parts, offsets, bounds[:-1], bounds[1:]):
+            if first == last:
+                continue
+            local = unique[first:last] - offset
+            res.append(read_valid(part, local))
+
+        if not res:
+            res = np.empty((0, *self.shape[1:]), dtype=self.dtype)
+        else:
+            res = np.concatenate(res)
+            if not in_order:
+                res = res[inverse]
+
+        return fill_output_buffer(res, out)
+
+
+
@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import tempfile
+from types import SimpleNamespace
+import numpy as np
+
+from .pidranges import PIDRanges
+
+
+INDEX_VERSION = 3
+ENV_INDEX_DIR = "SFDATA_INDEX_DIR"
+DEFAULT_INDEX_DIR = "~/.cache/sfdata"
+
+NAME_META = "meta"
+PREFIX_PIDS = "pids_"
+PREFIX_RUNS = "runs_"
+
+
+class FileIndex:
+    """
+    Structure of an hdf5 data file (channel names, data shapes, dtypes, chunk layouts, number of entries and pulse IDs)
+    that can be stored in a sidecar file, which is keyed by the absolute path of the data file
+    and valid as long as size and modification time of the data file do not change.
+    The pulse IDs are stored as PIDRanges runs where this is compact (and as plain arrays otherwise),
+    and are only expanded (or read from the sidecar file) per channel via get_pids().
+    """
+
+    def __init__(self, fname, size, mtime, channels, pids, index_fname=None):
+        self.fname = fname
+        self.size = size
+        self.mtime = mtime
+        self.channels = channels # {name: SimpleNamespace(shape, dtype, chunks, ntotal)}
+        self.pids = pids # {name: PIDRanges or pids array}, plain arrays that are missing are read from index_fname on demand
+        self.index_fname = index_fname
+
+    @classmethod
+    def from_channels(cls, fname, channels):
+        """Create the index for fname from an iterable of SFChannels"""
+        fname = os.path.abspath(fname)
+        size, mtime = get_file_stamp(fname)
+        infos = {}
+        pids = {}
+        for chan in channels:
+            name = chan.name
+            infos[name] = get_channel_info(chan)
+            pids[name] = encode_pids(chan._get_raw_pids())
+        return cls(fname, size, mtime, infos, pids)
+
+
+    def __repr__(self):
+        return f"{self.fname}: {len(self.channels)} channels"
+
+    @property
+    def names(self):
+        return list(self.channels)
+
+    def get_pids(self, name):
+        """Pulse IDs of the channel name as plain array"""
+        pids = self.pids.get(name)
+        if pids is None:
+            if name not in self.names:
+                raise KeyError(name)
+            i = self.names.index(name)
+            with np.load(self.index_fname, allow_pickle=False) as npz:
+                return npz[f"{PREFIX_PIDS}{i}"]
+        if isinstance(pids, PIDRanges):
+            return pids.to_array()
+        return pids
+
+    def is_current(self):
+        """Check whether the data file still has the size and modification time stored in the index"""
+        try:
+            stamp = get_file_stamp(self.fname)
+        except OSError:
+            return False
+        return stamp == (self.size, self.mtime)
+
+
+    def save(self, index_fname):
+        """Write atomically to index_fname, i.e., concurrent readers either see the old or the new index"""
+        names = self.names
+        dtypes = {}
+        arrays = {}
+        for i, n in enumerate(names):
+            pids = self.pids.get(n)
+            if pids is None:
+                pids = self.get_pids(n)
+            if isinstance(pids, PIDRanges):
+                dtypes[n] = pids.dtype.str
+                arrays[f"{PREFIX_RUNS}{i}"] = np.stack([pids.starts, pids.steps, pids.counts])
+            else:
+                arrays[f"{PREFIX_PIDS}{i}"] = pids
+
+        meta = dict(
+            version = INDEX_VERSION,
+            fname = self.fname,
+            size = self.size,
+            mtime = self.mtime,
+            names = names,
+            channels = {n: vars(self.channels[n]) for n in names},
+            dtypes = dtypes
+        )
+        arrays[NAME_META] = np.array(json.dumps(meta))
+
+        folder = os.path.dirname(index_fname)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(suffix=".npz", dir=folder)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_fname, index_fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
+
+    @classmethod
+    def load(cls, index_fname):
+        """Load names and pulse ID runs, pulse IDs stored as plain arrays are only read on demand (see get_pids)"""
+        with np.load(index_fname, allow_pickle=False) as npz:
+            meta = json.loads(str(npz[NAME_META]))
+            if meta["version"] != INDEX_VERSION:
+                raise ValueError(f"unsupported index version: {meta['version']}")
+            names = meta["names"]
+            channels = {n: make_channel_info(**meta["channels"][n]) for n in names}
+            dtypes = meta["dtypes"]
+            pids = {}
+            for i, n in enumerate(names):
+                if n in dtypes:
+                    pids[n] = PIDRanges(*npz[f"{PREFIX_RUNS}{i}"], dtype=dtypes[n])
+        return cls(meta["fname"], meta["size"], meta["mtime"], channels, pids, index_fname=index_fname)
+
+
+
+def load_index(fname):
+    """
+    Load the index for the data file fname from its sidecar file,
+    returns None if there is no index, or if it is stale or unreadable
+    """
+    fname = os.path.abspath(fname)
+    index_fname = get_index_filename(fname)
+    try:
+        index = FileIndex.load(index_fname)
+    except Exception: # missing or broken sidecar files are simply rebuilt
+        return None
+    if index.fname != fname or not index.is_current():
+        return None
+    return index
+
+
+def get_index_filename(fname):
+    """Sidecar file for the data file fname within the index folder ($SFDATA_INDEX_DIR or ~/.cache/sfdata)"""
+    fname = os.path.abspath(fname)
+    folder = os.environ.get(ENV_INDEX_DIR, DEFAULT_INDEX_DIR)
+    folder = os.path.expanduser(folder)
+    key = hashlib.sha1(fname.encode()).hexdigest()
+    return os.path.join(folder, f"{key}.npz")
+
+
+def get_file_stamp(fname):
+    stat = os.stat(fname)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def encode_pids(pids):
+    """Encode pids as PIDRanges unless they are not strictly increasing or would need too many runs"""
+    try:
+        return PIDRanges.from_array(pids)
+    except ValueError:
+        return pids
+
+
+def get_channel_info(chan):
+    """
+    Shape, dtype and chunk layout of the data dataset and number of entries of chan,
+    dtypes that cannot be restored from their string representation (e.g., compound or strings) are stored as None
+    """
+    data = chan.datasets.data
+    dtype = data.dtype
+    simple = (dtype.fields is None and not dtype.hasobject)
+    return make_channel_info(
+        shape = data.shape,
+        dtype = dtype.str if simple else None,
+        chunks = data.chunks,
+        ntotal = chan.ntotal
+    )
+
+
+def make_channel_info(shape, dtype, chunks, ntotal):
+    shape = tuple(shape)
+    chunks = tuple(chunks) if chunks is not None else None
+    return SimpleNamespace(shape=shape, dtype=dtype, chunks=chunks, ntotal=ntotal)
+
+
+
@@ -1,6 +1,9 @@
 import numpy as np
 
 
+CHUNK_BYTES = 1024**2 # target size of automatically chosen chunks
+
+
 def h5_boolean_indexing(ds, indices):
     """
     hdf5 does not support boolean indexing on the first axis for n-dim. datasets:
@@ -18,3 +21,15 @@ def h5_boolean_indexing(ds, indices):
 
 
 
+def get_chunk_shape(entry_shape, itemsize, chunk_bytes=CHUNK_BYTES):
+    """
+    Chunk shape for a dataset that grows along the first axis with entries of entry_shape,
+    each chunk holds as many whole entries as fit into chunk_bytes (but at least one),
+    such that appending and reading along the first axis touches few chunks
+    """
+    entry_bytes = max(1, int(np.prod(entry_shape)) * itemsize)
+    rows = max(1, chunk_bytes // entry_bytes)
+    return (rows, *entry_shape)
+
+
+
@@ -0,0 +1,38 @@
+import h5py
+import numpy as np
+
+
+MAPPABLE_DRIVERS = ("sec2", "stdio") # file drivers that store the dataset bytes as is in a single file on disk
+MAPPABLE_KINDS = "biufc"
+
+
+def get_memmap(dataset):
+    """
+    Return a read-only np.memmap of an hdf5 dataset without copying through h5py,
+    which is possible for datasets with contiguous storage, a known file offset and without filters.
+    Returns None for all other datasets (e.g., chunked, compressed, virtual, external or not yet allocated).
+    """
+    if not is_mappable(dataset):
+        return None
+
+    offset = dataset.id.get_offset()
+    if offset is None: # storage not allocated yet
+        return None
+
+    fname = dataset.file.filename
+    return np.memmap(fname, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape)
+
+
+def is_mappable(dataset):
+    return (
+        isinstance(dataset, h5py.Dataset) and
+        dataset.chunks is None and
+        dataset.external is None and
+        not dataset.is_virtual and
+        dataset.size > 0 and
+        dataset.dtype.kind in MAPPABLE_KINDS and
+        dataset.file.driver in MAPPABLE_DRIVERS
+    )
+
+
+
@@ -0,0 +1,113 @@
+from functools import reduce
+import numpy as np
+
+from .pidranges import PIDRanges
+from .utils import typename
+
+
+class PIDAlignment:
+    """
+    Alignment of the pulse IDs of several channels onto the union of all their pulse IDs (all_pids):
+    - index_maps[i] holds the positions of the pulse IDs of channel i within all_pids
+    - counts[i] is the number of distinct pulse IDs of channel i
+    - shared_mask marks the entries of all_pids that are present in every channel
+    Everything is computed once via sorted merges / searchsorted instead of pairwise set operations.
+    """
+
+    def __init__(self, names, pids):
+        names = list(names)
+        pids = [np.asarray(p) for p in pids]
+
+        self.names = names
+        self.pids = pids
+        self.all_pids = all_pids = unite_pids(pids)
+
+        self.index_maps = [np.searchsorted(all_pids, p) for p in pids]
+        self.increasing = [is_strictly_increasing(p) for p in pids]
+        self.counts = np.array([count_distinct(m, inc) for m, inc in zip(self.index_maps, self.increasing)], dtype=int)
+
+        nchannels = len(names)
+        npresent = np.zeros(len(all_pids), dtype=int)
+        for m, inc in zip(self.index_maps, self.increasing):
+            if not inc:
+                m = np.unique(m)
+            npresent[m] += 1
+        self.shared_mask = (npresent == nchannels)
+
+
+    def __repr__(self):
+        tn = typename(self)
+        return f"{tn}: {len(self.names)} channels x {self.nall} pulse IDs"
+
+    @property
+    def nall(self):
+        return len(self.all_pids)
+
+    @property
+    def nshared(self):
+        return int(np.count_nonzero(self.shared_mask))
+
+    @property
+    def shared_pids(self):
+        return self.all_pids[self.shared_mask]
+
+
+    def presence(self, i):
+        """Boolean row marking which entries of all_pids are present in channel i"""
+        res = np.zeros(self.nall, dtype=bool)
+        res[self.index_maps[i]] = True
+        return res
+
+    def presence_matrix(self):
+        """Boolean channels x pids presence bitmap"""
+        res = np.zeros((len(self.names), self.nall), dtype=bool)
+        for i, m in enumerate(self.index_maps):
+            res[i, m] = True
+        return res
+
+    def shared_indices(self, i):
+        """Indices into the pulse IDs of channel i that are present in every channel"""
+        if self.increasing[i]:
+            in_shared = self.shared_mask[self.index_maps[i]]
+            return np.flatnonzero(in_shared)
+        # duplicated or unsorted pids: first occurrences ordered by pulse ID as for np.intersect1d
+        _inters, ind_chan, _ind_shared = np.intersect1d(self.pids[i], self.shared_pids, return_indices=True)
+        return ind_chan
+
+    def indices_of_shared(self, pids):
+        """Indices into pids (e.g., those of a channel as after reset_valid) of the entries that are in shared_pids"""
+        pids = np.asarray(pids)
+        shared = self.shared_pids
+        if not is_strictly_increasing(pids):
+            _inters, ind, _ind_shared = np.intersect1d(pids, shared, return_indices=True)
+            return ind
+        pos = np.searchsorted(shared, pids)
+        pos[pos == len(shared)] = 0
+        found = (shared[pos] == pids) if len(shared) else np.zeros(len(pids), dtype=bool)
+        return np.flatnonzero(found)
+
+
+
+def unite_pids(pids):
+    if not pids:
+        return np.empty(0, dtype=int)
+    try:
+        ranges = [PIDRanges.from_array(p) for p in pids]
+        united = reduce(PIDRanges.union, ranges)
+    except ValueError: # pids cannot be range-encoded (compactly)
+        return np.unique(np.concatenate(pids))
+    else:
+        return united.to_array()
+
+
+def is_strictly_increasing(arr):
+    return arr.ndim == 1 and bool(np.all(np.diff(arr) > 0))
+
+
+def count_distinct(index_map, increasing):
+    if increasing:
+        return len(index_map)
+    return len(np.unique(index_map))
+
+
+
@@ -0,0 +1,300 @@
+from math import gcd
+import numpy as np
+
+from .utils import typename
+
+
+# arrays that need more runs than this fraction of their length (but at least MIN_MAX_RUNS) are not encoded,
+# since the set operations, which loop over the runs, would be slower than their numpy equivalents on the plain arrays
+MAX_RUNS_FRACTION = 0.01
+MIN_MAX_RUNS = 100
+
+
+class PIDRanges:
+    """
+    Compact representation of strictly increasing pulse IDs as runs of arithmetic progressions:
+    run i contains the values starts[i] + k * steps[i] for k in range(counts[i]).
+    Pulse IDs are typically progressions with stride 1 (or the rep-rate stride) and a few gaps,
+    thus, set operations, membership and index lookup cost O(number of runs) instead of O(number of pulses).
+    The plain array is only created via to_array() / np.asarray().
+    """
+
+    def __init__(self, starts=(), steps=(), counts=(), dtype=np.int64):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.steps  = np.asarray(steps,  dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.dtype = np.dtype(dtype)
+
+
+    @classmethod
+    def from_array(cls, arr, limit=True):
+        """
+        Encode a 1D strictly increasing integer array,
+        greedily extending each run as long as the difference between neighbors stays the same.
+        Raises ValueError if arr cannot be encoded or, if limit is True, would need too many runs (see MAX_RUNS_FRACTION).
+        """
+        arr = np.asarray(arr)
+        if arr.ndim != 1:
+            raise ValueError(f"can only encode 1D arrays, got {arr.ndim}D")
+        if len(arr) == 0:
+            return cls(dtype=arr.dtype)
+        if arr.dtype.kind not in "iu":
+            raise ValueError(f"can only encode integer arrays, got {arr.dtype}")
+
+        values = arr.astype(np.int64)
+        diffs = np.diff(values)
+        if np.any(diffs <= 0):
+            raise ValueError("can only encode strictly increasing arrays")
+
+        changes = np.flatnonzero(diffs[1:] != diffs[:-1]) + 1
+        min_nruns = (len(changes) + 1) // 2 # a run absorbs at most two changes of the difference
+        max_nruns = max(MIN_MAX_RUNS, int(MAX_RUNS_FRACTION * len(values)))
+        if limit and min_nruns > max_nruns:
+            raise ValueError(f"encoding would need at least {min_nruns} runs for {len(values)} values")
+
+        bounds = np.r_[0, changes, len(diffs)].tolist()
+
+        starts = []
+        steps  = []
+        counts = []
+        pos = 0 # index of the first value not yet assigned to a run
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            first = max(first, pos) # the diff linking the already assigned value is not usable
+            if first >= last:
+                continue
+            starts.append(values[pos])
+            steps.append(diffs[first])
+            counts.append(last - pos + 1)
+            pos = last + 1
+
+        if pos < len(values): # single remaining value
+            starts.append(values[pos])
+            steps.append(1)
+            counts.append(1)
+
+        return cls(starts, steps, counts, dtype=arr.dtype)
+
+
+    def to_array(self):
+        n = len(self)
+        if n == 0:
+            return np.empty(0, dtype=self.dtype)
+        run_offsets = self._run_offsets()
+        run_indices = np.repeat(np.arange(self.nruns), self.counts)
+        ks = np.arange(n) - run_offsets[run_indices]
+        res = self.starts[run_indices] + ks * self.steps[run_indices]
+        return res.astype(self.dtype, copy=False)
+
+    def __array__(self, dtype=None, copy=None):
+        res = self.to_array()
+        if dtype is not None:
+            res = res.astype(dtype, copy=False)
+        return res
+
+
+    @property
+    def nruns(self):
+        return len(self.starts)
+
+    @property
+    def lasts(self):
+        return self.starts + (self.counts - 1) * self.steps
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def __iter__(self):
+        for start, step, count in zip(self.starts.tolist(), self.steps.tolist(), self.counts.tolist()):
+            yield from range(start, start + step * count, step)
+
+    def __repr__(self):
+        tn = typename(self)
+        return f"{tn}: {len(self)} pulse IDs in {self.nruns} runs"
+
+
+    def __contains__(self, value):
+        return bool(self.contains([value])[0])
+
+    def contains(self, values):
+        """Vectorized membership test, returns a boolean array"""
+        return self.positions(values) >= 0
+
+    def positions(self, values):
+        """
+        Vectorized index lookup,
+        returns the positions of values within to_array() and -1 for values that are not contained
+        """
+        values = np.asarray(values, dtype=np.int64)
+        res = np.full(values.shape, -1, dtype=np.int64)
+        if self.nruns == 0:
+            return res
+
+        runs = np.searchsorted(self.starts, values, side="right") - 1
+        inside = (runs >= 0)
+        runs = np.where(inside, runs, 0)
+
+        deltas = values - self.starts[runs]
+        steps = self.steps[runs]
+        ks = deltas // steps
+        found = inside & (deltas % steps == 0) & (ks < self.counts[runs])
+
+        run_offsets = self._run_offsets()
+        res[found] = run_offsets[runs[found]] + ks[found]
+        return res
+
+    def _run_offsets(self):
+        return np.r_[0, np.cumsum(self.counts)[:-1]]
+
+
+    def intersection(self, other):
+        """Intersect with other sweeping over both runs in order, O(nruns_self + nruns_other)"""
+        dtype = self.dtype
+        a = _runs(self)
+        b = _runs(other)
+
+        res = []
+        i = j = 0
+        while i < len(a) and j < len(b):
+            a_start, a_step, a_last = a[i]
+            b_start, b_step, b_last = b[j]
+            run = intersect_progressions(a_start, a_step, a_last, b_start, b_step, b_last)
+            if run is not None:
+                res.append(run)
+            if a_last < b_last:
+                i += 1
+            else:
+                j += 1
+
+        return _from_runs(res, dtype)
+
+    def union(self, other):
+        """
+        Unite with other sweeping over both runs in order, O(nruns_self + nruns_other):
+        overlapping runs are merged if they have the same step and phase, otherwise only they are expanded and re-encoded
+        """
+        dtype = self.dtype
+        runs = sorted(_runs(self) + _runs(other))
+
+        res = []
+        cluster = []
+        cluster_last = None
+        for run in runs:
+            start, _step, last = run
+            if cluster and start > cluster_last:
+                res.extend(unite_cluster(cluster))
+                cluster = []
+            if not cluster:
+                cluster_last = last
+            cluster.append(run)
+            cluster_last = max(cluster_last, last)
+        if cluster:
+            res.extend(unite_cluster(cluster))
+
+        return _from_runs(res, dtype)
+
+    __and__ = intersection
+    __or__  = union
+
+
+
+def intersect_progressions(a_start, a_step, a_last, b_start, b_step, b_last):
+    """
+    Intersect two arithmetic progressions given by start, step and last value,
+    returns the resulting run as (start, step, last) or None if the intersection is empty
+    """
+    lo = max(a_start, b_start)
+    hi = min(a_last, b_last)
+    if lo > hi:
+        return None
+
+    g = gcd(a_step, b_step)
+    if (b_start - a_start) % g != 0:
+        return None
+
+    # solve x = a_start (mod a_step) and x = b_start (mod b_step), the solution repeats with the lcm of the steps
+    m = b_step // g
+    t = (b_start - a_start) // g * modinv(a_step // g, m) % m if m > 1 else 0
+    x = a_start + a_step * t
+    step = a_step * m
+
+    first = lo + (x - lo) % step # smallest value >= lo in the progression
+    if first > hi:
+        return None
+
+    last = first + (hi - first) // step * step
+    return first, step, last
+
+
+def modinv(a, m):
+    """Modular inverse of a modulo m (a and m coprime) via the extended Euclidean algorithm"""
+    x0, x1 = 1, 0
+    b = m
+    while b:
+        q = a // b
+        a, b = b, a - q * b
+        x0, x1 = x1, x0 - q * x1
+    return x0 % m
+
+
+def unite_cluster(cluster):
+    """Unite runs (start, step, last) whose ranges overlap"""
+    if len(cluster) == 1:
+        return cluster
+
+    starts, steps, lasts = zip(*cluster)
+    first = min(starts)
+    last = max(lasts)
+
+    step = steps[0]
+    same_phase = all(s == step for s in steps) and all((s - first) % step == 0 for s in starts)
+    if same_phase:
+        return [(first, step, last)]
+
+    finest = min(cluster, key=lambda run: run[1])
+    fine_start, fine_step, fine_last = finest
+    covers_all = (fine_start == first and fine_last == last)
+    contains_all = all(s % fine_step == 0 and (start - fine_start) % fine_step == 0 for start, s, _last in cluster)
+    if covers_all and contains_all: # e.g., a run with the rep-rate stride within a run with stride 1
+        return [finest]
+
+    values = [np.arange(start, last + 1, step) for start, step, last in cluster]
+    values = np.unique(np.concatenate(values))
+    return _runs(PIDRanges.from_array(values, limit=False))
+
+
+def _runs(ranges):
+    """Runs as list of (start, step, last) tuples of python ints"""
+    return list(zip(ranges.starts.tolist(), ranges.steps.tolist(), ranges.lasts.tolist()))
+
+
+def _from_runs(runs, dtype):
+    """Create PIDRanges from sorted disjoint runs given as (start, step, last), merging neighboring runs where possible"""
+    starts = []
+    steps  = []
+    counts = []
+    for start, step, last in runs:
+        count = (last - start) // step + 1
+        if count == 1:
+            step = 1
+        if starts:
+            prev_start, prev_step, prev_count = starts[-1], steps[-1], counts[-1]
+            prev_last = prev_start + (prev_count - 1) * prev_step
+            gap = start - prev_last
+            if prev_count == 1 and count == 1:
+                steps[-1] = gap
+                counts[-1] = 2
+                continue
+            if gap == step and (prev_step == step or prev_count == 1):
+                steps[-1] = step
+                counts[-1] += count
+                continue
+            if count == 1 and gap == prev_step:
+                counts[-1] += 1
+                continue
+        starts.append(start)
+        steps.append(step)
+        counts.append(count)
+    return PIDRanges(starts, steps, counts, dtype=dtype)
+
+
+
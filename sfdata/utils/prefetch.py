@@ -0,0 +1,79 @@
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+
+
+POLL_INTERVAL = 0.1 # seconds between checks whether the consumer is gone
+
+# kinds of queue entries
+ITEM  = "item"
+ERROR = "error"
+DONE  = "done"
+
+
+def prefetched(iterable, n):
+    """
+    Iterate over iterable while a background thread produces up to n items ahead,
+    the items and their order are identical to iterating directly.
+    Exceptions raised by iterable are re-raised in the consuming thread.
+    Closing the generator early stops the background thread.
+    n=0 (or None) iterates directly without a background thread.
+    """
+    if not n:
+        yield from iterable
+        return
+
+    queue = Queue(maxsize=n)
+    stop = Event()
+
+    thread = Thread(target=produce, args=(iterable, queue, stop), daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            kind, item = queue.get()
+            if kind is DONE:
+                return
+            if kind is ERROR:
+                raise item
+            yield item
+    finally:
+        stop.set()
+        drain(queue)
+        thread.join()
+
+
+def produce(iterable, queue, stop):
+    try:
+        for item in iterable:
+            if not put(queue, (ITEM, item), stop):
+                return
+    except BaseException as exc:
+        put(queue, (ERROR, exc), stop)
+    else:
+        put(queue, (DONE, None), stop)
+
+
+def put(queue, entry, stop):
+    """
+    Put entry into queue blocking while it is full,
+    returns False if stop is set before the entry could be put
+    """
+    while not stop.is_set():
+        try:
+            queue.put(entry, timeout=POLL_INTERVAL)
+        except Full:
+            continue
+        else:
+            return True
+    return False
+
+
+def drain(queue):
+    while True:
+        try:
+            queue.get_nowait()
+        except Empty:
+            return
+
+
+
@@ -0,0 +1,87 @@
+import h5py
+
+
+MB = 1024**2
+
+MSG_LOCKING_MISMATCH = "file locking flag values don't match"
+
+
+# keyword arguments for h5py.File, see https://docs.h5py.org/en/stable/high/file.html#chunk-cache
+PROFILES = {
+    # h5py/HDF5 defaults: 1 MB chunk cache per dataset, file locking enabled
+    "default": {},
+
+    # reading frames in order, e.g., in batches:
+    # the cache holds several (large) chunks, and chunks that have been read completely are evicted first
+    "sequential-frames": dict(
+        rdcc_nbytes = 256 * MB,
+        rdcc_nslots = 10007,
+        rdcc_w0 = 1.0,
+        locking = False
+    ),
+
+    # reading entries in arbitrary order, e.g., subsets after drop_missing:
+    # a large cache that evicts the least recently used chunks
+    "random-access": dict(
+        rdcc_nbytes = 1024 * MB,
+        rdcc_nslots = 100003,
+        rdcc_w0 = 0.0,
+        locking = False
+    ),
+
+    # only names, shapes, dtypes and pulse IDs are needed:
+    # no chunk cache at all
+    "metadata-only": dict(
+        rdcc_nbytes = 0,
+        rdcc_nslots = 1,
+        locking = False
+    )
+}
+
+
+def get_profile_kwargs(profile):
+    """
+    Return the h5py.File keyword arguments for profile,
+    which can be None (default), the name of one of the PROFILES or a dict of keyword arguments
+    """
+    if profile is None:
+        return {}
+    if isinstance(profile, dict):
+        return dict(profile)
+    try:
+        return dict(PROFILES[profile])
+    except KeyError as exc:
+        available = ", ".join(PROFILES)
+        raise ValueError(f"Unknown access profile \"{profile}\"; must be one of {available}") from exc
+
+
+def get_open_kwargs(h5):
+    """
+    Reconstruct the h5py.File keyword arguments needed to reopen the already open h5 elsewhere (e.g., in a worker process)
+    the same way, i.e., the chunk cache settings of its access profile and the SWMR mode (see SFDataFile with follow=True)
+    """
+    _mdc_nelmts, rdcc_nslots, rdcc_nbytes, rdcc_w0 = h5.id.get_access_plist().get_cache()
+    kwargs = dict(rdcc_nslots=rdcc_nslots, rdcc_nbytes=rdcc_nbytes, rdcc_w0=rdcc_w0)
+    if h5.swmr_mode:
+        kwargs["swmr"] = True
+    return kwargs
+
+
+def open_h5_with_profile(fname, mode="r", profile=None):
+    """
+    Open fname via h5py.File with the keyword arguments of profile,
+    HDF5 refuses to open a file that is already open in this process with different locking flags,
+    in this case, the locking flag of the profile is dropped (the file is locked or not already anyway).
+    Note that HDF5 shares the open file, thus, all settings of the profile only take effect if the file is not open yet.
+    """
+    kwargs = get_profile_kwargs(profile)
+    try:
+        return h5py.File(fname, mode=mode, **kwargs)
+    except OSError as exc:
+        if "locking" not in kwargs or MSG_LOCKING_MISMATCH not in str(exc):
+            raise
+    kwargs.pop("locking")
+    return h5py.File(fname, mode=mode, **kwargs)
+
+
+
@@ -0,0 +1,253 @@
+import h5py
+from h5py import h5s
+import numpy as np
+
+
+FULL_READ_FRACTION = 0.5 # read the whole span if at least this fraction of it (or of its chunks) is needed
+MAX_SLICE_RUNS = 8       # read run by run if there are only this many runs, otherwise as one hyperslab selection
+
+READABLE_KINDS = "biufc" # dtypes that can be read into preallocated numpy arrays
+
+
+def read_valid(dataset, valid, out=None, dtype=None):
+    """
+    Read dataset[valid] from an hdf5 dataset choosing the cheapest strategy for the selection:
+    - "span": read everything between the first and the last valid entry at once, then select
+    - "slices": read each contiguous run of valid entries separately
+    - "hyperslab": read all contiguous runs merged into one hyperslab selection
+    valid can be Ellipsis, a boolean mask or a sorted sequence of unique indices.
+    For anything else (or if dataset is not an hdf5 dataset), the whole dataset is read and valid is applied afterwards.
+    Datasets that provide their own read_valid method (e.g., ConcatDataset) are read via that.
+    If out is given, the result is written into it (see as_output_buffer), and out is returned.
+    Otherwise, if dtype is given, the result is allocated with dtype and converted while reading (i.e., by hdf5),
+    which avoids a copy in the stored precision.
+    """
+    if out is None and dtype is not None and np.dtype(dtype) != dataset.dtype:
+        nvalid = count_valid(valid, len(dataset))
+        if nvalid is None:
+            return np.asarray(read_valid(dataset, valid)).astype(dtype)
+        out = np.empty((nvalid, *dataset.shape[1:]), dtype=dtype)
+
+    own_read_valid = getattr(dataset, "read_valid", None)
+    if own_read_valid is not None:
+        return own_read_valid(valid, out=out)
+
+    if valid is Ellipsis:
+        if out is None:
+            return dataset[:]
+        if is_plannable(dataset):
+            dataset.read_direct(as_output_buffer(out, dataset.shape))
+        else:
+            as_output_buffer(out, dataset.shape)[:] = dataset[:]
+        return out
+
+    if not is_plannable(dataset):
+        return fill_output_buffer(dataset[:][valid], out)
+
+    indices = as_sorted_indices(valid, len(dataset))
+    if indices is None:
+        return fill_output_buffer(dataset[:][valid], out)
+
+    strategy, starts, stops = plan_read(dataset, indices)
+
+    out_shape = (len(indices), *dataset.shape[1:])
+    if out is None:
+        res = out = np.empty(out_shape, dtype=dataset.dtype)
+    else:
+        res = out
+        out = as_output_buffer(out, out_shape)
+
+    if strategy == "empty":
+        pass
+    elif strategy == "span":
+        read_span(dataset, indices, out)
+    elif strategy == "slices":
+        read_slices(dataset, starts, stops, out)
+    elif strategy == "hyperslab":
+        read_hyperslabs(dataset, starts, stops, out)
+    else:
+        raise ValueError(f"unknown read strategy: {strategy}")
+
+    return res
+
+
+def as_output_buffer(out, shape):
+    """
+    View of out with the given shape without copying,
+    out may also have the shape with all entries of length 1 squeezed (e.g., (n,) instead of (n, 1) for column vectors)
+    """
+    shape = tuple(shape)
+    if not out.flags.c_contiguous:
+        raise ValueError("output buffer needs to be contiguous")
+    if out.shape == shape:
+        return out
+    squeezed = tuple(n for n in shape[1:] if n != 1)
+    if out.shape != (shape[0], *squeezed):
+        raise ValueError(f"output buffer has shape {out.shape} but the result has shape {shape}")
+    return out.reshape(shape) # a view since out is contiguous
+
+
+def fill_output_buffer(res, out):
+    if out is None:
+        return res
+    as_output_buffer(out, res.shape)[:] = res
+    return out
+
+
+def plan_read(dataset, indices):
+    """
+    Decide how to read the entries at indices (sorted, unique) from dataset along the first axis,
+    returns the strategy name and the contiguous runs of indices as arrays of starts and stops
+    """
+    starts, stops = indices_to_runs(indices)
+    nruns = len(starts)
+
+    if nruns == 0:
+        return "empty", starts, stops
+
+    if nruns == 1 or needed_fraction(dataset, indices) >= FULL_READ_FRACTION:
+        return "span", starts, stops
+
+    if nruns <= MAX_SLICE_RUNS and not runs_share_chunks(dataset, starts, stops):
+        return "slices", starts, stops
+
+    return "hyperslab", starts, stops
+
+
+def needed_fraction(dataset, indices):
+    """
+    Fraction of the span between the first and the last index that is actually needed,
+    for chunked datasets this is counted in chunks since a chunk is always read (and decompressed) as a whole
+    """
+    first = indices[0]
+    last  = indices[-1]
+
+    chunks = dataset.chunks
+    if chunks is None:
+        nspan = last - first + 1
+        return len(indices) / nspan
+
+    chunk_rows = chunks[0]
+    chunk_indices = indices // chunk_rows
+    ntouched = np.count_nonzero(np.diff(chunk_indices)) + 1 # indices are sorted
+    nspan = chunk_indices[-1] - chunk_indices[0] + 1
+    return ntouched / nspan
+
+
+def runs_share_chunks(dataset, starts, stops):
+    """
+    Check whether any two consecutive runs touch the same chunk,
+    which would then be read (and decompressed) once per run
+    """
+    chunks = dataset.chunks
+    if chunks is None:
+        return False
+
+    chunk_rows = chunks[0]
+    last_chunks = (stops[:-1] - 1) // chunk_rows
+    first_chunks = starts[1:] // chunk_rows
+    return np.any(last_chunks == first_chunks)
+
+
+def read_span(dataset, indices, out):
+    start = indices[0]
+    stop  = indices[-1] + 1
+    if stop - start == len(indices): # dense, i.e., no selection needed
+        dataset.read_direct(out, source_sel=np.s_[start:stop])
+        return
+    source = dataset if dataset.dtype == out.dtype else dataset.astype(out.dtype) # convert while reading
+    span = source[start:stop]
+    np.take(span, indices - start, axis=0, out=out)
+
+
+def read_slices(dataset, starts, stops, out):
+    offset = 0
+    for start, stop in zip(starts, stops):
+        n = stop - start
+        dataset.read_direct(out, source_sel=np.s_[start:stop], dest_sel=np.s_[offset:offset+n])
+        offset += n
+
+
+def read_hyperslabs(dataset, starts, stops, out):
+    other_dims = dataset.shape[1:]
+    zeros = (0,) * len(other_dims)
+
+    fspace = dataset.id.get_space()
+    fspace.select_none()
+    for start, stop in zip(starts, stops):
+        fspace.select_hyperslab((start, *zeros), (stop - start, *other_dims), op=h5s.SELECT_OR)
+
+    mspace = h5s.create_simple(out.shape)
+    dataset.id.read(mspace, fspace, out)
+
+
+def indices_to_runs(indices):
+    """
+    Convert sorted unique indices into contiguous runs,
+    returns arrays of run starts and (exclusive) stops
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy()
+
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = indices[np.r_[0, breaks]]
+    stops  = indices[np.r_[breaks - 1, len(indices) - 1]] + 1
+    return starts, stops
+
+
+def count_valid(valid, ntotal):
+    """
+    Number of entries selected by valid (Ellipsis, a boolean mask or indices),
+    returns None if valid selects along more than one axis
+    """
+    if valid is Ellipsis:
+        return ntotal
+    valid = np.asanyarray(valid)
+    if valid.ndim != 1:
+        return None
+    if valid.dtype == bool:
+        return int(np.count_nonzero(valid))
+    return len(valid)
+
+
+def as_sorted_indices(valid, ntotal):
+    """
+    Convert valid (boolean mask or indices) into sorted unique non-negative indices,
+    returns None if this is not possible without changing the meaning of valid
+    """
+    valid = np.asanyarray(valid)
+
+    if valid.ndim != 1:
+        return None
+
+    if len(valid) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if valid.dtype == bool:
+        if len(valid) != ntotal:
+            return None
+        return np.flatnonzero(valid)
+
+    if valid.dtype.kind not in "iu":
+        return None
+
+    if valid[0] < 0 or valid[-1] >= ntotal:
+        return None
+
+    if not np.all(np.diff(valid) > 0):
+        return None
+
+    return valid.astype(np.int64, copy=False)
+
+
+def is_plannable(dataset):
+    return (
+        isinstance(dataset, h5py.Dataset) and
+        dataset.ndim > 0 and
+        dataset.dtype.kind in READABLE_KINDS
+    )
+
+
+
@@ -8,13 +8,14 @@ def main():
     parser.add_argument("filenames", type=str, nargs="+", help="names of files to read, accepts wildcards")
     parser.add_argument("-c", "--complete", action="store_true", help="also show channels that have the complete set of pulse IDs")
     parser.add_argument("-n", "--no-color", action="store_true", help="do not color the output")
+    parser.add_argument("-i", "--index", action="store_true", help="use (and create if needed) the sidecar index of the files, stored in $SFDATA_INDEX_DIR or ~/.cache/sfdata")
 
     clargs = parser.parse_args()
 
 
     from sfdata import SFDataFiles
 
-    with SFDataFiles(*clargs.filenames) as data:
+    with SFDataFiles(*clargs.filenames, index=clargs.index) as data:
         data.print_stats(show_complete=clargs.complete, color=not clargs.no_color)
 
 
@@ -27,6 +27,7 @@ if __name__ == '__main__':
     from test_sfprocfile import TestSFProcFile
     from test_sfscaninfo import TestSFScanInfo
     from test_utils_filestatus import TestUtilsFileStatus
+    from test_utils_pidranges import TestUtilsPIDRanges
     from test_utils import TestUtils
 
     import unittest
@@ -2,6 +2,7 @@
 
 import os
 import io
+import h5py
 import numpy as np
 import unittest.mock
 
@@ -9,10 +10,19 @@ from utils import TestCase, identity, make_temp_filename, read_names, load_df_fr
 from consts import FNAME_ALL, FNAME_SCALARS, FNAME_DF, CH_1D_COL_NAME, CH_1D_COL_DATA, CH_1D_NAME, CH_1D_PIDS, CH_1D_DATA, CH_ND_NAME, CH_ND_SHAPE, CH_ND_DATA1, REPR_CHANNEL
 
 from sfdata import SFDataFiles
+from sfdata.utils import DirectChunkDataset, adjust_shape, get_bshuf_kwargs, is_direct_readable
 from sfdata.sfchannel import SFChannel, get_dataset
 from sfdata.errors import DatasetNotInGroupError
 
 
+def check_float32(batch):
+    return np.full(len(batch), batch.dtype == np.float32)
+
+def is_greater_one(batch):
+    return batch > 1
+
+
+
 class TestSFChannel(TestCase):
 
     df_ref_lists = load_df_from_csv(FNAME_DF)
@@ -40,6 +50,47 @@ class TestSFChannel(TestCase):
             self.data[CH_1D_NAME].pids, CH_1D_PIDS
         )
 
+    def test_pids_cache(self):
+        ch = self.data[CH_1D_NAME]
+        pids = ch.pids
+        self.assertIs(
+            ch.pids, pids
+        )
+        self.assertFalse(
+            pids.flags.writeable
+        )
+
+        ch.offset = 1
+        self.assertAllEqual(
+            ch.pids, np.array(CH_1D_PIDS) - 1
+        )
+        ch.offset = 0
+
+        ch.valid = [0, 2]
+        self.assertAllEqual(
+            ch.pids, [0, 2]
+        )
+
+        raw_pids = ch._raw_pids
+        ch.reset_valid()
+        self.assertAllEqual(
+            ch.pids, CH_1D_PIDS
+        )
+        self.assertIs(
+            ch._raw_pids, raw_pids # valid is reapplied without reading again
+        )
+
+    def test_pids_cache_closed(self):
+        with SFDataFiles(FNAME_SCALARS) as data:
+            ch = data[CH_1D_NAME]
+            ch.pids
+        self.assertIsNone(
+            ch._raw_pids
+        )
+        self.assertIsNone(
+            ch._pids
+        )
+
     def test_reset_valid(self):
         self.ch.valid = None
         self.ch.reset_valid()
@@ -197,6 +248,29 @@ class TestSFChannel(TestCase):
                     )
 
 
+    def test_conversion_dtype(self):
+        with SFDataFiles("fake_data/run_dtypes.SCALARS.h5") as data:
+            for func in (data.to_dataframe, data.to_dataframe_accumulate, data.to_dataframe_fill):
+                df = func(as_nullable=True, dtype=np.float32)
+                for ch in df:
+                    ref = "b" if ch.startswith("b") else "f" # only numeric channels are converted
+                    self.assertEqual(
+                        df[ch].dtype.kind, ref
+                    )
+                self.assertEqual(
+                    df["f_ch1"].dtype, np.float32
+                )
+
+            for func in (data.to_xarray, data.to_xarray_accumulate):
+                ds = func(dtype={"i_ch1": np.int8})
+                self.assertEqual(
+                    ds["i_ch1"].dtype, np.int8
+                )
+                self.assertEqual(
+                    ds["f_ch1"].dtype, np.float64
+                )
+
+
     @unittest.mock.patch("sfdata.sfdata.tqdm", identity)
     def test_to_xarray(self):
         #TODO: reference only works for 1D arrays
@@ -331,6 +405,17 @@ class TestSFChannel(TestCase):
                 )
 
 
+    def test_in_batches_prefetch(self):
+        ch = self.data[CH_1D_NAME]
+        for index, batch in ch.in_batches(1, prefetch=2):
+            self.assertAllEqual(
+                batch, ch.data[index]
+            )
+        self.assertAllEqual(
+            ch.apply_in_batches(lambda x: x, 1, prefetch=2), CH_1D_DATA
+        )
+
+
     def test_apply_in_batches(self):
         nop = lambda x: x
         for i in range(4):
@@ -344,6 +429,188 @@ class TestSFChannel(TestCase):
                 )
 
 
+    def test_apply_in_batches_workers(self):
+        func = np.negative # needs to be picklable
+        # starting a pool of worker processes is slow, thus, only two cases: many batches and a limited number of batches
+        for name, size, n in ((CH_ND_NAME, 1, None), (CH_1D_NAME, 1, 2)):
+            ch = self.data[name]
+            ref = ch.apply_in_batches(func, size, n)
+            res = ch.apply_in_batches(func, size, n, workers=2)
+            self.assertEqual(
+                res.dtype, ref.dtype
+            )
+            self.assertAllEqual(
+                res, ref
+            )
+
+
+    def test_apply_in_batches_res_dtype(self):
+        ch = self.data[CH_ND_NAME]
+        ref = ch.data > 1
+
+        res = ch.apply_in_batches(is_greater_one, 1)
+        self.assertEqual(
+            res.dtype, bool
+        )
+        self.assertAllEqual(
+            res, ref
+        )
+
+        res = ch.apply_in_batches(is_greater_one, 1, res_dtype=np.uint8)
+        self.assertEqual(
+            res.dtype, np.uint8
+        )
+
+        # the worker path is covered by writing into a memmap (one pool of worker processes only)
+        for workers in (None, 2):
+            fname = make_temp_filename(suffix=".npy")
+            out = np.lib.format.open_memmap(fname, mode="w+", dtype=bool, shape=ref.shape)
+            with unittest.mock.patch("sfdata.utils.batching.tempfile.mkstemp", side_effect=AssertionError("no temporary copy expected")):
+                res = ch.apply_in_batches(is_greater_one, 2, workers=workers, out=out) # workers write into the file of out directly
+            self.assertIs(res, out)
+            self.assertAllEqual(
+                np.load(fname), ref
+            )
+            del out, res
+            os.remove(fname)
+
+        with self.assertRaises(ValueError):
+            ch.apply_in_batches(is_greater_one, out=np.empty(3))
+
+
+    def test_mmap(self):
+        for name in (CH_1D_NAME, CH_1D_COL_NAME, CH_ND_NAME):
+            ch = self.data[name]
+            ref = ch.data
+            ch.mmap = True
+            res = ch.data
+            self.assertIsInstance(
+                res, np.memmap
+            )
+            self.assertFalse(
+                res.flags.writeable
+            )
+            self.assertAllEqual(
+                res, ref
+            )
+            ch.valid = [0, 2]
+            self.assertAllEqual(
+                ch.data, ref[[0, 2]]
+            )
+            ch.reset_valid()
+            ch.mmap = False
+
+    def test_read_out(self):
+        for name in (CH_1D_NAME, CH_1D_COL_NAME, CH_ND_NAME):
+            ch = self.data[name]
+            ref = ch.data
+            out = np.empty(ref.shape) # column vectors are squeezed
+            res = ch.read(out=out)
+            self.assertTrue(
+                np.shares_memory(res, out)
+            )
+            self.assertAllEqual(
+                out, ref
+            )
+            ch.valid = [0, 2]
+            out = np.zeros(ch.shape) # as stored
+            ch.read(out)
+            out = adjust_shape(out)
+            self.assertAllEqual(
+                out, ref[[0, 2]]
+            )
+            ch.reset_valid()
+
+    def test_read_dtype(self):
+        for name in (CH_1D_NAME, CH_1D_COL_NAME, CH_ND_NAME):
+            ch = self.data[name]
+            ref = ch.data.astype(np.float32)
+            for valid in (Ellipsis, [0, 2], [2]):
+                ch.valid = valid
+                res = ch.read(dtype=np.float32)
+                self.assertEqual(
+                    res.dtype, np.float32
+                )
+                self.assertAllEqual(
+                    res, ref[valid]
+                )
+            ch.reset_valid()
+
+            for _indices, batch in ch.in_batches(size=2, dtype=np.float32):
+                self.assertEqual(
+                    batch.dtype, np.float32
+                )
+            res = ch.apply_in_batches(check_float32, size=2, dtype=np.float32)
+            self.assertAllEqual(
+                res, np.ones(len(ch))
+            )
+
+    def test_mmap_fallback(self):
+        fname = make_temp_filename(suffix=".h5")
+        with h5py.File(fname, "w") as f:
+            group = f.create_group("test")
+            group.create_dataset("data", data=np.arange(10), chunks=(5,), compression="gzip")
+            group.create_dataset("pulse_id", data=np.arange(10))
+            ch = SFChannel("test", group)
+            ch.mmap = True
+            res = ch.data
+            self.assertNotIsInstance(
+                res, np.memmap
+            )
+            self.assertAllEqual(
+                res, np.arange(10)
+            )
+        os.remove(fname)
+
+
+    def test_decompress_threads(self):
+        arr = np.arange(11 * 6 * 7, dtype=np.uint16).reshape(11, 6, 7)
+        fname = make_temp_filename(suffix=".h5")
+        with h5py.File(fname, "w") as f:
+            group = f.create_group("test")
+            group.create_dataset("data", shape=(13, 6, 7), maxshape=(None, 6, 7), dtype=arr.dtype, chunks=(4, 4, 7), **get_bshuf_kwargs())
+            group["data"][:11] = arr # the last chunk row is not written and padded along the second axis
+            group.create_dataset("pulse_id", data=np.arange(13))
+            group.create_dataset("gzip", data=arr, chunks=(4, 6, 7), compression="gzip")
+            ch = SFChannel("test", group)
+            ref = ch.data
+            ch.decompress_threads = 3
+            self.assertIsInstance(
+                ch._get_data_dataset(), DirectChunkDataset
+            )
+            self.assertAllEqual(
+                ch.data, ref
+            )
+            ch.valid = np.arange(13) % 3 == 0
+            self.assertAllEqual(
+                ch.data, ref[ch.valid]
+            )
+            for valid in ([0, 2, 3, 9, 12], [5], []):
+                ch.valid = valid
+                self.assertAllEqual(
+                    ch.data, ref[valid]
+                )
+                res = np.concatenate([batch for _indices, batch in ch.in_batches(size=2)] or [ref[:0]])
+                self.assertAllEqual(
+                    res, ref[valid]
+                )
+            out = np.empty((3, 6, 7), dtype=np.float32)
+            ch.valid = [1, 2, 12]
+            ch.read(out=out)
+            self.assertAllEqual(
+                out, ref[[1, 2, 12]]
+            )
+            ch.valid = [3, 1] # not sorted, read via the hdf5 filter pipeline
+            self.assertAllEqual(
+                ch.data, ref[[3, 1]]
+            )
+
+            self.assertFalse(
+                is_direct_readable(group["gzip"])
+            )
+        os.remove(fname)
+
+
     def test_broken(self):
         ch = self.data[CH_1D_NAME]
         with self.assertNotRaises():
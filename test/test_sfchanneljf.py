@@ -86,9 +86,9 @@ class TestSFChannelJF(TestCase):
     @unittest.mock.patch("sfdata.sfdatafile.ju", None)
     def test_no_ju(self):
         modfname = sfdata.sfdatafile.__file__
-        line = 29 #TODO this will break!
+        line = 34 #TODO this will break!
         prefix = f"{modfname}:{line}: UserWarning: "
-        suffix = "\n  self.file, channels = load_from_file(fname)"
+        suffix = "\n  self.file, channels = load_from_file(fname, self.index, profile)"
         msg = "Could not import jungfrau_utils, will treat JF files as regular files."
         msg = prefix + msg + suffix
         with self.assertPrintsError(msg):
@@ -1,4 +1,5 @@
 import re
+import numpy as np
 
 from utils import TestCase
 from consts import FNAME_ALL, FNAME_SCALARS, FNAME_ARRAYS, REPR_SUBSET, CH_NAMES, CH_1D_NAME, CH_ND_NAME, CH_1D_DATA, CH_1D_PIDS, ALL_PIDS, ANY_PIDS, PRINT_STATE_COMPLETE_FALSE, PRINT_STATE_COMPLETE_TRUE
@@ -39,6 +40,14 @@ class TestSFData(TestCase):
             self.data.all_pids, ALL_PIDS
         )
 
+    def test_pid_ranges(self):
+        self.assertAllEqual(
+            self.data.pid_ranges.to_array(), ANY_PIDS
+        )
+        self.assertAllEqual(
+            self.data.all_pid_ranges.to_array(), ALL_PIDS
+        )
+
     def test_names(self):
         self.assertEqual(
             sorted(self.data.names), CH_NAMES
@@ -68,6 +77,46 @@ class TestSFData(TestCase):
             self.data.print_stats(show_complete=True, color=False)
 
 
+    def test_alignment_cache(self):
+        al = self.data.alignment
+        self.assertIs(
+            self.data.alignment, al
+        )
+        self.assertAllEqual(
+            al.shared_pids, ANY_PIDS
+        )
+
+        chan = self.data[CH_1D_NAME]
+        chan.offset = 1
+        try:
+            self.assertIsNot(
+                self.data.alignment, al
+            )
+        finally:
+            chan.offset = 0
+
+    def test_drop_missing(self):
+        self.data.drop_missing(show_stats=False)
+        for chan in self.data.values():
+            self.assertAllEqual(
+                chan.pids, ANY_PIDS
+            )
+        self.data.reset_valid()
+
+    def test_drop_missing_respects_valid(self):
+        chan = self.data[CH_1D_NAME]
+        chan.valid = np.arange(2)
+        expected = np.intersect1d(chan.pids, ANY_PIDS)
+        try:
+            self.data.drop_missing(show_stats=False)
+            for c in self.data.values():
+                self.assertAllEqual(
+                    c.pids, expected
+                )
+        finally:
+            self.data.reset_valid()
+
+
     def test_add_channel(self):
         with SFDataFile(FNAME_SCALARS) as data1, SFDataFiles(FNAME_ARRAYS) as data2:
             old_names = data1.names
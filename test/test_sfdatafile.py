@@ -1,16 +1,43 @@
 #!/usr/bin/env python
 
-import unittest
+import unittest.mock
 import sys
-
-from utils import TestCase, check_channel_closed
+import os
+import shutil
+import tempfile
+import multiprocessing as mp
+import h5py
+import numpy as np
+
+from utils import TestCase, check_channel_closed, make_temp_filename
 from hiddenmod import HiddenModule
 from consts import FNAME_SCALARS, REPR_FILE, CH_1D_NAME, CH_1D_DATA, CH_1D_COL_NAME
 
 from sfdata import SFDataFile
+from sfdata.sfchannel import SFChannel
+from sfdata.lazychannel import LazyChannel
+from sfdata.utils import FileIndex, PIDRanges, get_index_filename
+from sfdata.utils.fileindex import encode_pids, make_channel_info
 from sfdata.errors import NoUsableChannelError
 
 
+def write_swmr(fname, ready, proceed, done):
+    """Writer process: write 5 pulses, wait for the reader, append 7 more pulses"""
+    with h5py.File(fname, "w", libver="latest") as f:
+        data = f.create_dataset("data/ch/data", shape=(0,), maxshape=(None,), chunks=(4,), dtype=float)
+        pids = f.create_dataset("data/ch/pulse_id", shape=(0,), maxshape=(None,), chunks=(4,), dtype=int)
+        f.swmr_mode = True
+        for start, stop in ((0, 5), (5, 12)):
+            if start > 0:
+                proceed.wait()
+            for ds, values in ((pids, np.arange(start, stop)), (data, np.arange(start, stop) / 10)):
+                ds.resize((stop,))
+                ds[start:stop] = values
+                ds.flush()
+            ready.set()
+        done.wait()
+
+
 class TestSFDataFile(TestCase):
 
     def run(self, *args, **kwargs):
@@ -94,6 +121,238 @@ class TestSFDataFile(TestCase):
             with SFDataFile("fake_data/run_spurious_chans_only.ARRAYS.h5") as data:
                 pass
 
+    def test_lazy_channels(self):
+        with SFDataFile(FNAME_SCALARS) as data:
+            entries = dict(dict.items(data))
+            self.assertTrue(
+                all(isinstance(e, LazyChannel) for e in entries.values())
+            )
+            ch = data[CH_1D_NAME]
+            self.assertTrue(
+                isinstance(ch, SFChannel)
+            )
+            self.assertIs(
+                dict.__getitem__(data, CH_1D_NAME), ch
+            )
+            self.assertIs(
+                entries[CH_1D_NAME].resolve(), ch
+            )
+        check_channel_closed(self, ch)
+
+    def test_lazy_broken_channel(self):
+        fname = make_temp_filename(suffix=".h5")
+        try:
+            with h5py.File(fname, "w") as f:
+                f["data/good/data"] = [1, 2, 3]
+                f["data/good/pulse_id"] = [0, 1, 2]
+                f["data/broken/pulse_id"] = [0, 1, 2]
+                f["data/dangling/data"] = h5py.SoftLink("/nowhere")
+                f["data/dangling/pulse_id"] = [0, 1, 2]
+
+            msg = 'Skipping channel "broken" since it caused DatasetNotInGroupError: Cannot get dataset "data" from: <HDF5 group "/data/broken" (1 members)>'
+            with self.assertWarns(msg):
+                data = SFDataFile(fname)
+
+            with data:
+                # groups without the needed datasets are skipped right away
+                self.assertEqual(
+                    data.names, {"good", "dangling"}
+                )
+                self.assertEqual(
+                    len(data), 2
+                )
+
+                # channels that pass the check but cannot be created are removed on first access
+                msg = 'Skipping channel "dangling" since it caused DatasetNotInGroupError: Cannot get dataset "data" from: <HDF5 group "/data/dangling" (2 members)>'
+                with self.assertWarns(msg):
+                    self.assertEqual(
+                        [ch.name for ch in data.values()], ["good"]
+                    )
+                self.assertEqual(
+                    data.names, {"good"}
+                )
+                with self.assertRaises(KeyError):
+                    data["dangling"]
+        finally:
+            os.remove(fname)
+
+
+    def test_index(self):
+        folder = tempfile.mkdtemp()
+        fname = os.path.join(folder, "run_index.SCALARS.h5")
+        shutil.copy(FNAME_SCALARS, fname)
+        env = os.environ.get("SFDATA_INDEX_DIR")
+        os.environ["SFDATA_INDEX_DIR"] = os.path.join(folder, "index")
+        try:
+            index_fname = get_index_filename(fname)
+            self.assertFalse(
+                os.path.exists(index_fname)
+            )
+
+            with SFDataFile(fname, index=True) as data:
+                ref_names = data.names
+                ref_pids = data[CH_1D_NAME].pids.copy()
+                ref_ch = data[CH_1D_NAME]
+                ref_struct = (ref_ch.shape, ref_ch.dtype, ref_ch.ntotal)
+                ref_chunks = ref_ch.datasets.data.chunks
+            self.assertTrue(
+                os.path.exists(index_fname)
+            )
+
+            with SFDataFile(fname, index=True) as data:
+                self.assertEqual(
+                    data.names, ref_names
+                )
+                self.assertIsInstance(
+                    data.index.pids[CH_1D_NAME], PIDRanges
+                )
+                self.assertEqual(
+                    data.index.channels[CH_1D_NAME].chunks, ref_chunks
+                )
+                ch = data[CH_1D_NAME]
+                self.assertIsNot(
+                    ch._raw_pids, None
+                )
+                # structure is served from the index without opening the datasets
+                self.assertEqual(
+                    (ch.shape, ch.dtype, ch.ntotal), ref_struct
+                )
+                self.assertEqual(
+                    vars(ch.datasets).keys() & {"data", "pids"}, set()
+                )
+                self.assertAllEqual(
+                    ch.pids, ref_pids
+                )
+                self.assertAllEqual(
+                    ch.data, CH_1D_DATA
+                )
+            check_channel_closed(self, ch)
+
+            # stale index is rebuilt
+            stat = os.stat(fname)
+            os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            index = FileIndex.load(index_fname)
+            self.assertFalse(
+                index.is_current()
+            )
+            with SFDataFile(fname, index=True) as data:
+                self.assertTrue(
+                    data.index.is_current()
+                )
+            self.assertTrue(
+                FileIndex.load(index_fname).is_current()
+            )
+        finally:
+            if env is None:
+                del os.environ["SFDATA_INDEX_DIR"]
+            else:
+                os.environ["SFDATA_INDEX_DIR"] = env
+            shutil.rmtree(folder)
+
+
+    def test_index_pids(self):
+        folder = tempfile.mkdtemp()
+        try:
+            index_fname = os.path.join(folder, "index.npz")
+            pids = {"regular": np.arange(10), "unordered": np.array([3, 1, 2])}
+            encoded = {n: encode_pids(p) for n, p in pids.items()}
+            infos = {n: make_channel_info(shape=p.shape, dtype=p.dtype.str, chunks=None, ntotal=len(p)) for n, p in pids.items()}
+            FileIndex(FNAME_SCALARS, 0, 0, infos, encoded).save(index_fname)
+
+            index = FileIndex.load(index_fname)
+            self.assertEqual(
+                vars(index.channels["regular"]), vars(infos["regular"])
+            )
+            self.assertIsInstance(
+                index.pids["regular"], PIDRanges
+            )
+            self.assertNotIn(
+                "unordered", index.pids # plain arrays are only read on demand
+            )
+            for name, ref in pids.items():
+                self.assertAllEqual(
+                    index.get_pids(name), ref
+                )
+            with self.assertRaises(KeyError):
+                index.get_pids("missing")
+        finally:
+            shutil.rmtree(folder)
+
+
+    def test_profile(self):
+        for profile in ("sequential-frames", "random-access", "metadata-only"):
+            with SFDataFile(FNAME_SCALARS, profile=profile) as data:
+                self.assertAllEqual(
+                    data[CH_1D_NAME].data, CH_1D_DATA
+                )
+
+        # the settings only apply if the file is not open already (FNAME_SCALARS is open in run)
+        fname = make_temp_filename(suffix=".h5")
+        shutil.copy(FNAME_SCALARS, fname)
+        try:
+            with SFDataFile(fname, profile="sequential-frames") as data:
+                rdcc_nslots, rdcc_nbytes, rdcc_w0 = data.file.id.get_access_plist().get_cache()[1:]
+                self.assertEqual(
+                    (rdcc_nslots, rdcc_nbytes, rdcc_w0), (10007, 256 * 1024**2, 1.0)
+                )
+        finally:
+            os.remove(fname)
+
+
+    def test_follow(self):
+        fname = make_temp_filename(suffix=".h5")
+        ctx = mp.get_context("spawn")
+        ready, proceed, done = ctx.Event(), ctx.Event(), ctx.Event()
+        writer = ctx.Process(target=write_swmr, args=(fname, ready, proceed, done))
+        writer.start()
+        try:
+            self.assertTrue(ready.wait(timeout=30))
+            ready.clear()
+            with SFDataFile(fname, follow=True) as data:
+                ch = data["ch"]
+                batches = list(ch.in_batches(size=3, new=True))
+                self.assertAllEqual(
+                    np.concatenate([b for _, b in batches]), np.arange(5) / 10
+                )
+                self.assertEqual(
+                    list(ch.in_batches(new=True)), []
+                )
+                self.assertEqual(
+                    data.alignment.nall, 5
+                )
+
+                proceed.set()
+                self.assertTrue(ready.wait(timeout=30))
+                data.refresh()
+
+                self.assertEqual(
+                    ch.ntotal, 12
+                )
+                self.assertEqual(
+                    data.alignment.nall, 12
+                )
+                batches = list(ch.in_batches(size=3, new=True))
+                self.assertEqual(
+                    batches[0][0], slice(5, 8)
+                )
+                self.assertAllEqual(
+                    np.concatenate([b for _, b in batches]), np.arange(5, 12) / 10
+                )
+                self.assertAllEqual(
+                    ch.pids, np.arange(12)
+                )
+                self.assertEqual(
+                    len(ch.apply_in_batches(np.negative, new=True)), 0
+                )
+                self.assertAllEqual(
+                    ch.apply_in_batches(np.negative, size=3, workers=1), -np.arange(12) / 10
+                )
+        finally:
+            done.set()
+            writer.join()
+            os.remove(fname)
+
+
     def test_missing_ju_import(self):
         import sfdata.sfdatafile
         self.assertNotEqual(
@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 
+import os
+import shutil
+import tempfile
+import h5py
+import numpy as np
+
 from utils import TestCase, check_channel_closed
 from consts import FNAME_ALL, FNAME_SCALARS, REPR_FILES, CH_1D_NAME, CH_1D_DATA, CH_ND_NAME, CH_ND_DATA1
 
 import sfdata
 from sfdata import SFDataFiles
 from sfdata.errors import NoMatchingFileError
+from sfdata.sfchannelconcat import SFChannelConcat
 
 
 class TestSFDataFiles(TestCase):
@@ -34,7 +41,7 @@ class TestSFDataFiles(TestCase):
         with self.assertRaises(NoMatchingFileError):
             SFDataFiles("does not exist")
         modfname = sfdata.sfdatafiles.__file__
-        line = 77 #TODO this will break!
+        line = 96 #TODO this will break!
         prefix = f"{modfname}:{line}: UserWarning: "
         suffix = "\n  print_skip_warning(exc, quoted_fn)"
         broken_file = "fake_data/run_broken.SCALARS.h5"
@@ -107,6 +114,82 @@ class TestSFDataFiles(TestCase):
         msg = "The following channels from fake_data/run_test.SCALARS.h5 are masked by channels from fake_data/run_test.SCALARS.h5: ['ch1', 'ch2', 'ch3']"
         with self.assertWarns(msg):
             sfdata.sfdatafiles.load_files([FNAME_SCALARS, FNAME_SCALARS])
+        with self.assertWarns(msg):
+            sfdata.sfdatafiles.load_files([FNAME_SCALARS, FNAME_SCALARS], workers=2)
+
+    def test_concat(self):
+        folder = tempfile.mkdtemp()
+        try:
+            fnames = []
+            for i, (pids, names) in enumerate(((range(0, 4), ["a", "b"]), (range(4, 7), ["a", "c"]))):
+                fn = os.path.join(folder, f"run_{i:06}.SCALARS.h5")
+                with h5py.File(fn, "w") as f:
+                    for n in names:
+                        f[f"data/{n}/pulse_id"] = np.array(pids)
+                        f[f"data/{n}/data"] = np.array(pids) * 10
+                fnames.append(fn)
+
+            pattern = os.path.join(folder, "run_*.SCALARS.h5")
+            with SFDataFiles(pattern, concat=True) as data:
+                self.assertEqual(
+                    data.names, {"a", "b", "c"}
+                )
+                ch = data["a"]
+                self.assertTrue(
+                    isinstance(ch, SFChannelConcat)
+                )
+                self.assertAllEqual(
+                    ch.pids, np.arange(7)
+                )
+                self.assertAllEqual(
+                    ch.data, np.arange(7) * 10
+                )
+                self.assertAllEqual(
+                    ch[2:6], [20, 30, 40, 50]
+                )
+                self.assertAllEqual(
+                    ch.apply_in_batches(np.negative, size=3), -np.arange(7) * 10
+                )
+
+                data.drop_missing(show_stats=False)
+                self.assertAllEqual(
+                    data["a"].pids, []
+                )
+                data.reset_valid()
+                subset = data["a", "c"]
+                subset.drop_missing(show_stats=False)
+                self.assertAllEqual(
+                    subset["a"].data, [40, 50, 60]
+                )
+                df = subset.to_dataframe()
+                self.assertAllEqual(
+                    df.index, [4, 5, 6]
+                )
+            check_channel_closed(self, ch.channels[0])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_workers(self):
+        with SFDataFiles(FNAME_ALL, workers=4) as data:
+            self.assertEqual(
+                data.fnames, self.data.fnames
+            )
+            self.assertEqual(
+                data.names, self.data.names
+            )
+            self.assertAllEqual(
+                data[CH_1D_NAME].data, CH_1D_DATA
+            )
+
+        broken_file = "fake_data/run_broken.SCALARS.h5"
+        msg = f"Skipping \"{broken_file}\" since it caused OSError: Unable to open file (file signature not found)"
+        with self.assertWarns(msg):
+            with SFDataFiles(broken_file, FNAME_SCALARS, workers=2) as data:
+                self.assertEqual(
+                    data.fnames, [FNAME_SCALARS]
+                )
+
+        sfdata.sfdatafiles.warm_up_file("does_not_exist.h5") # errors are reported when opening
 
 
 
@@ -2,11 +2,16 @@
 
 import os
 import h5py
+import numpy as np
 
 from utils import TestCase
+from consts import FNAME_ALL, FNAME_ARRAYS, CH_ND_NAME, ANY_PIDS
 
-from sfdata import SFProcFile
+from sfdata import SFProcFile, SFDataFile, SFDataFiles
 from sfdata.errors import ArrayLengthMismatch
+from sfdata.sfchannel import SFChannel
+from sfdata.sfchannelwriter import SFChannelWriter
+from sfdata.utils.bshuf import BSHUF_FILTER
 
 
 FNAME = "tmp_test_sfprocfile.h5"
@@ -15,6 +20,9 @@ PIDS = [0, 1, 2]
 DATA = [3, 4, 5]
 
 
+def sum_frames(batch):
+    return batch.sum(axis=(1, 2))
+
 def read_h5_data(fname, name):
     with h5py.File(fname, "r") as f:
         pids = f[f"/data/{name}/pulse_id"][:]
@@ -70,6 +78,165 @@ class TestSFProcFile(TestCase):
                 f.add_channel(CHNAME, PIDS, DATA)
             self._assertPidsData(CHNAME)
 
+    def test_add_virtual_channel(self):
+        with self.assertCreatesTempFile(FNAME):
+            with SFDataFiles(FNAME_ALL) as data:
+                subset = data[data.names]
+                subset.drop_missing(show_stats=False)
+                with SFProcFile(FNAME) as f:
+                    f.add_virtual_channels(*subset.values())
+                    ref = {n: (ch.pids, ch.data) for n, ch in subset.items()}
+
+                with h5py.File(FNAME, "r") as f:
+                    self.assertTrue(
+                        f[f"/data/{CH_ND_NAME}/data"].is_virtual
+                    )
+
+                with SFDataFile(FNAME) as f:
+                    for n, (pids, data) in ref.items():
+                        self.assertAllEqual(f[n].pids, pids)
+                        self.assertAllEqual(f[n].data, data)
+                        self.assertAllEqual(f[n].pids, ANY_PIDS)
+            subset.reset_valid()
+
+    def test_add_virtual_channel_valid(self):
+        with self.assertCreatesTempFile(FNAME):
+            with SFDataFile(FNAME_ARRAYS) as data:
+                ch = data[CH_ND_NAME]
+                mask = np.arange(ch.ntotal) % 2 == 0
+                ch.valid = mask
+                ref_pids, ref_data = ch.pids, ch.data
+                try:
+                    with SFProcFile(FNAME) as f:
+                        self.assertIsNone(
+                            f.add_virtual_channel(ch) # cannot be read while the original file is open
+                        )
+
+                        ch.valid = np.flatnonzero(mask)[::-1]
+                        with self.assertRaises(ValueError):
+                            f.add_virtual_channel(ch, "unsorted")
+
+                        ch.reset_valid()
+                        broken = SFChannel(CH_ND_NAME, ch._group)
+                        broken.datasets.data = ch.data # not an hdf5 dataset
+                        with self.assertRaises(TypeError):
+                            f.add_virtual_channel(broken, "broken")
+
+                        self.assertEqual(
+                            set(f.data), {CH_ND_NAME}
+                        )
+                finally:
+                    ch.reset_valid()
+
+            with SFDataFile(FNAME) as f:
+                self.assertAllEqual(f[CH_ND_NAME].pids, ref_pids)
+                self.assertAllEqual(f[CH_ND_NAME].data, ref_data)
+
+    def test_create_channel(self):
+        with self.assertCreatesTempFile(FNAME):
+            with SFProcFile(FNAME) as f:
+                w = f.create_channel(CHNAME)
+                w.append(PIDS[:2], DATA[:2])
+                w.append(PIDS[2:], DATA[2:])
+                self.assertEqual(
+                    repr(w), f"SFChannelWriter(\"{CHNAME}\"): 3 pids, 3 data entries"
+                )
+            self._assertPidsData(CHNAME)
+
+            with h5py.File(FNAME, "r") as f:
+                ds = f[f"/data/{CHNAME}/data"]
+                self.assertEqual(
+                    ds.maxshape, (None,)
+                )
+                self.assertIsNotNone(ds.chunks)
+
+    def test_create_channel_append_batches(self):
+        with self.assertCreatesTempFile(FNAME):
+            with SFDataFile(FNAME_ARRAYS) as data:
+                ch = data[CH_ND_NAME]
+                with SFProcFile(FNAME) as f:
+                    with f.create_channel(CHNAME, dtype="float32") as w:
+                        w.append_batches(ch, sum_frames, size=2)
+                    self.assertAllEqual(
+                        f[CHNAME].pids, ch.pids
+                    )
+                    self.assertAllEqual(
+                        f[CHNAME].data, ch.data.sum(axis=(1, 2)).astype(np.float32)
+                    )
+                    self.assertEqual(
+                        f[CHNAME].dtype, np.float32
+                    )
+
+    def test_create_channel_bitshuffle(self):
+        frames = np.arange(5 * 300 * 400, dtype=np.uint16).reshape(5, 300, 400)
+        pids = np.arange(5)
+        with self.assertCreatesTempFile(FNAME):
+            with SFProcFile(FNAME) as f:
+                with f.create_channel(CHNAME, compression="bitshuffle", workers=2) as w:
+                    for i in range(0, 5, 2): # 2 of the 4 frames per chunk are buffered across appends
+                        w.append(pids[i:i+2], frames[i:i+2])
+
+            with h5py.File(FNAME, "r") as f:
+                ds = f[f"/data/{CHNAME}/data"]
+                self.assertEqual(
+                    ds.chunks, (4, 300, 400)
+                )
+                self.assertIn(
+                    str(BSHUF_FILTER), ds._filters
+                )
+
+            with SFDataFile(FNAME) as f:
+                self.assertAllEqual(
+                    f[CHNAME].pids, pids
+                )
+                self.assertAllEqual(
+                    f[CHNAME].data, frames
+                )
+
+        with self.assertRaises(ValueError):
+            SFChannelWriter(CHNAME, None, compression="invalid")
+
+    def test_create_channel_bitshuffle_reused_buffer(self):
+        buf = np.empty((8, 300, 400), dtype=np.uint16) # two whole chunks per append
+        ref = []
+        with self.assertCreatesTempFile(FNAME):
+            with SFProcFile(FNAME) as f:
+                with f.create_channel(CHNAME, compression="bitshuffle", workers=4) as w:
+                    for i in range(10):
+                        buf[:] = i + 1
+                        ref.append(buf.copy())
+                        w.append(np.arange(i * 8, (i + 1) * 8), buf)
+                        buf[:] = 0 # the file needs to contain the values from before
+
+            with SFDataFile(FNAME) as f:
+                self.assertAllEqual(
+                    f[CHNAME].data, np.concatenate(ref)
+                )
+
+    def test_create_channel_bitshuffle_dtype(self):
+        data = np.random.default_rng(0).random((2000, 300)) # float64, several whole chunks per append
+        with self.assertCreatesTempFile(FNAME):
+            with SFProcFile(FNAME) as f:
+                with f.create_channel(CHNAME, dtype="float32", compression="bitshuffle") as w:
+                    w.append(np.arange(len(data)), data)
+
+            with SFDataFile(FNAME) as f:
+                self.assertAllEqual(
+                    f[CHNAME].data, data.astype(np.float32)
+                )
+
+    def test_create_channel_length_mismatch(self):
+        with self.assertCreatesTempFile(FNAME):
+            f = SFProcFile(FNAME)
+            w = f.create_channel(CHNAME)
+            with self.assertRaises(ArrayLengthMismatch):
+                w.append(PIDS, [])
+            w.append_pids(PIDS)
+            w.append_data(DATA[:2])
+            with self.assertRaises(ArrayLengthMismatch):
+                f.close()
+            self.assertFalse(f.file)
+
     def test_add_channel_length_mismatch(self):
         with self.assertCreatesTempFile(FNAME):
             with SFProcFile(FNAME) as f:
@@ -243,4 +410,90 @@ class TestSFProcFile(TestCase):
                     f.drop_missing()
 
 
+    def test_background(self):
+        with self.assertCreatesTempFile(FNAME):
+            with SFProcFile(FNAME, background=True, queue_size=1) as f:
+                self.assertIsNone(
+                    f.add_channel(CHNAME, PIDS, DATA)
+                )
+                self.assertIn(
+                    CHNAME, f
+                )
+                self.assertEqual(
+                    f.names, {CHNAME}
+                )
+                self.assertEqual(
+                    [ch.name for ch in f.values()], [CHNAME]
+                )
+                f.add_meta_entry(CHNAME, DATA)
+                w = f.create_channel(CHNAME + "_stream")
+                for p, d in zip(PIDS, DATA):
+                    w.append([p], [d])
+                self.assertEqual(
+                    len(f), 2
+                )
+                self.assertAllEqual(
+                    f[CHNAME].data, DATA
+                )
+            self._assertPidsData(CHNAME)
+            self._assertPidsData(CHNAME + "_stream")
+            self._assertMeta(CHNAME)
+
+    def test_background_reused_buffer(self):
+        buf = np.empty((8, 300, 400), dtype=np.uint16) # two whole chunks per append
+        pids = np.empty(8, dtype=np.int64)
+        ref = []
+        with self.assertCreatesTempFile(FNAME):
+            with SFProcFile(FNAME, background=True) as f:
+                with f.create_channel(CHNAME, compression="bitshuffle", workers=4) as w:
+                    for i in range(10):
+                        buf[:] = i + 1
+                        pids[:] = np.arange(i * 8, (i + 1) * 8)
+                        ref.append(buf.copy())
+                        w.append(pids, buf)
+                        buf[:] = 0 # the file needs to contain the values from before
+                        pids[:] = 0
+                f.add_channel(CHNAME + "_direct", np.arange(8), buf)
+                buf[:] = 1
+                f.add_meta_entry(CHNAME, DATA)
+
+            with SFDataFile(FNAME) as f:
+                self.assertAllEqual(
+                    f[CHNAME].pids, np.arange(80)
+                )
+                self.assertAllEqual(
+                    f[CHNAME].data, np.concatenate(ref)
+                )
+                self.assertAllEqual(
+                    f[CHNAME + "_direct"].data, np.zeros_like(buf)
+                )
+
+    def test_background_errors(self):
+        with self.assertCreatesTempFile(FNAME):
+            with SFProcFile(FNAME, background=True) as f:
+                with self.assertRaises(ArrayLengthMismatch):
+                    f.add_channel(CHNAME, PIDS, [])
+                f.add_channel(CHNAME, PIDS, DATA)
+                f.add_channel(CHNAME, PIDS, DATA) # name already exists
+                with self.assertRaises(ValueError):
+                    f.flush()
+
+            f = SFProcFile(FNAME, mode="w", background=True)
+            w = f.create_channel(CHNAME)
+            w.append_pids(PIDS)
+            with self.assertRaises(ArrayLengthMismatch):
+                f.close()
+            self.assertFalse(f.file)
+
+            # writers are closed even after an error, i.e., the last incomplete chunk is still written
+            f = SFProcFile(FNAME, mode="w", background=True)
+            w = f.create_channel(CHNAME, compression="bitshuffle")
+            w.append(PIDS, DATA)
+            w.append_data(np.ones((2, 3)))
+            with self.assertRaises(ValueError):
+                f.close()
+            self.assertFalse(f.file)
+            self._assertPidsData(CHNAME)
+
+
 
@@ -1,14 +1,23 @@
 #!/usr/bin/env python
 
 import unittest.mock
+import numpy as np
 
 from utils import TestCase
+from consts import CH_1D_NAME, CH_1D_DATA, CH_1D_PIDS
 
 import sfdata
-from sfdata import SFScanInfo
+from sfdata import SFScanInfo, SFDataFiles
 from sfdata.errors import NoUsableFileError
 
 
+def mean_1d(data):
+    return data[CH_1D_NAME].data.mean()
+
+def complex_mean_1d(data):
+    return mean_1d(data) * 1j
+
+
 class TestSFScanInfo(TestCase):
 
     nsteps = 3
@@ -43,6 +52,107 @@ class TestSFScanInfo(TestCase):
             for sf, rf in zip(step.files, ref.files):
                 self.assertEqual(sf.file, rf.file)
 
+    def test_prefetch(self):
+        scan = SFScanInfo(self.fname, prefetch=2)
+        for step, ref in zip(scan, self.scan):
+            for sf, rf in zip(step.files, ref.files):
+                self.assertEqual(sf.fname, rf.fname)
+
+        opened = []
+        def open_step(*fns, **kwargs):
+            data = SFDataFiles(*fns, **kwargs)
+            opened.append(data)
+            return data
+
+        with unittest.mock.patch("sfdata.sfscaninfo.SFDataFiles", side_effect=open_step):
+            for step in scan:
+                break # the other steps have been opened ahead
+
+        self.assertGreaterEqual(
+            len(opened), 1 # at least the first step, steps that were not started yet are cancelled
+        )
+        for step in opened:
+            for f in step.files:
+                self.assertFalse(f.file) # closed h5py files are falsy
+
+    def test_in_batches(self):
+        batches = list(self.scan.in_batches(CH_1D_NAME, size=2))
+        self.assertEqual(
+            [b.step for b in batches], [0, 0, 1, 1, 2, 2]
+        )
+        for b in batches:
+            self.assertEqual(
+                b.value, self.scan.values[b.step]
+            )
+            self.assertEqual(
+                b.readback, self.scan.readbacks[b.step]
+            )
+        for i in range(self.nsteps):
+            step_batches = [b for b in batches if b.step == i]
+            self.assertAllEqual(
+                np.concatenate([b.data for b in step_batches]), CH_1D_DATA
+            )
+            self.assertAllEqual(
+                np.concatenate([b.pids for b in step_batches]), CH_1D_PIDS
+            )
+
+    def test_in_batches_running_scan(self):
+        scan = SFScanInfo(self.fname)
+        scan.values = scan.values[:1] # the scan info of a running scan may list fewer values than files
+        scan.readbacks = scan.readbacks[:2]
+        batches = list(scan.in_batches(CH_1D_NAME, size=2))
+        self.assertEqual(
+            [b.value for b in batches], [scan.values[0]] * 2 + [None] * 4
+        )
+        self.assertEqual(
+            [b.readback for b in batches], [scan.readbacks[0]] * 2 + [scan.readbacks[1]] * 2 + [None] * 2
+        )
+
+    def test_in_batches_missing_channel(self):
+        msg = (f"Skipping step {i} since it caused KeyError: 'notachannel'" for i in range(self.nsteps))
+        with self.assertWarns(*msg):
+            batches = list(self.scan.in_batches("notachannel"))
+        self.assertEqual(
+            batches, []
+        )
+
+    def test_map(self):
+        ref = np.mean(CH_1D_DATA)
+        for workers in (None, 2):
+            res = self.scan.map(mean_1d, workers=workers)
+            self.assertAllEqual(
+                res.values, [ref] * self.nsteps
+            )
+            self.assertAllEqual(
+                res.coords["readbacks"], self.scan.readbacks
+            )
+            self.assertAllEqual(
+                res.coords["values"], self.scan.values
+            )
+
+    def test_map_complex(self):
+        res = self.scan.map(complex_mean_1d)
+        self.assertAllEqual(
+            res.values, [np.mean(CH_1D_DATA) * 1j] * self.nsteps
+        )
+
+    def test_map_failed_steps(self):
+        def fail_middle(data, calls=[]):
+            calls.append(None)
+            if len(calls) == 2:
+                raise ValueError("test")
+            return mean_1d(data)
+
+        msg = "Skipping step 1 ['fake_data/run_test.ARRAYS.h5', 'fake_data/run_test.SCALARS.h5'] since it caused ValueError: test"
+        with self.assertWarns(msg):
+            res = self.scan.map(fail_middle)
+        self.assertTrue(
+            np.isnan(res.values[1])
+        )
+        self.assertEqual(
+            np.count_nonzero(np.isnan(res.values)), 1
+        )
+
     def test_length(self):
         self.assertEqual(
             len(self.scan), self.nsteps
@@ -57,7 +167,7 @@ class TestSFScanInfo(TestCase):
     @unittest.mock.patch("sfdata.SFDataFiles.__init__", side_effect=Exception("test"))
     def test_broken(self, _):
         modfname = sfdata.sfscaninfo.__file__
-        line = 57 #TODO this will break!
+        line = 143 #TODO this will break!
         prefix = f"{modfname}:{line}: UserWarning: "
         suffix = "\n  print_skip_warning(exc, sn)"
         msg_fmt = "Skipping step {} ['fake_data/run_test.ARRAYS.h5', 'fake_data/run_test.SCALARS.h5'] since it caused Exception: test"
@@ -76,7 +186,7 @@ class TestSFScanInfo(TestCase):
 
     def test_no_files(self):
         modfname = sfdata.sfscaninfo.__file__
-        line = 57 #TODO this will break!
+        line = 143 #TODO this will break!
         prefix = f"{modfname}:{line}: UserWarning: "
         suffix = "\n  print_skip_warning(exc, sn)"
         msg_fmt = "Skipping step {} ['does not exist'] since it caused NoMatchingFileError: No matching hdf5 file for patterns: \"does not exist\""
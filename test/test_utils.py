@@ -1,14 +1,25 @@
 #!/usr/bin/env python
 
+import os
+import threading
+import h5py
 import numpy as np
 import pandas as pd
 
-from utils import TestCase
+from utils import TestCase, make_temp_filename
 from consts import FNAME_ARRAYS, FNAME_SCALARS, CH_ND_DATA1
 
 from sfdata import SFDataFile
-from sfdata.utils import print_line, cprint, typename, maxstrlen, strlen, percentage_missing, dip, decide_color, json_load, h5_boolean_indexing, decide_pandas_dtype, apply_batched, batched
+from sfdata.utils import print_line, cprint, typename, maxstrlen, strlen, percentage_missing, dip, decide_color, json_load, h5_boolean_indexing, get_chunk_shape, decide_pandas_dtype, apply_batched, batched
 from sfdata.utils.np import nothing_like
+from sfdata.utils.readplan import read_valid, plan_read, indices_to_runs, as_sorted_indices
+from sfdata.utils.batching import batch_slices, get_file_backing
+from sfdata.utils.prefetch import prefetched
+from sfdata.utils.bgwriter import BackgroundWriter
+from sfdata.utils.bshuf import compress_chunk, decompress_chunk, get_bshuf_kwargs
+from sfdata.utils.pidalignment import PIDAlignment
+from sfdata.utils.profiles import get_profile_kwargs, PROFILES
+from sfdata.utils.concat import ConcatDataset
 from sfdata.utils.progress import bar, percentage # not actually used anywhere
 
 
@@ -58,6 +69,21 @@ class TestUtils(TestCase):
             )
 
 
+    def test_get_chunk_shape(self):
+        self.assertEqual(
+            get_chunk_shape((), 8), (131072,)
+        )
+        self.assertEqual(
+            get_chunk_shape((512, 512), 4), (1, 512, 512)
+        )
+        self.assertEqual(
+            get_chunk_shape((4000, 4000), 4), (1, 4000, 4000)
+        )
+        self.assertEqual(
+            get_chunk_shape((3,), 8, chunk_bytes=100), (4, 3)
+        )
+
+
     def test_np_nothing_like(self):
         for dtype in (float, int):
             ref = np.empty(0, dtype=dtype)
@@ -190,6 +216,56 @@ class TestUtils(TestCase):
                 self.assertAllEqual(res, arr[:m*n])
 
 
+    def test_apply_batched_dtype(self):
+        arr = np.arange(7)
+        funcs = (
+            lambda x: x,
+            lambda x: x > 3,
+            lambda x: x * 1j,
+            lambda x: x.astype(np.uint8)
+        )
+        for func in funcs:
+            ref = func(arr)
+            for size in (1, 3, 10):
+                res = apply_batched(func, arr, arr, size)
+                self.assertEqual(res.dtype, ref.dtype)
+                self.assertAllEqual(res, ref)
+
+        res = apply_batched(np.sqrt, arr, arr, 3, dtype=np.float32)
+        self.assertEqual(res.dtype, np.float32)
+        self.assertAllEqual(res, np.sqrt(arr).astype(np.float32))
+
+        res = apply_batched(lambda x: np.array(["a" * i for i in x]), arr, arr, 3) # strings become longer than in the first batch
+        self.assertEqual(res.dtype, object)
+        self.assertEqual(res[-1], "a" * 6)
+
+        out = np.zeros(7, dtype=np.int16)
+        res = apply_batched(np.negative, arr, arr, 3, out=out)
+        self.assertIs(res, out)
+        self.assertAllEqual(out, -arr)
+
+        res = apply_batched(np.negative, arr, arr, 0, out=out)
+        self.assertIs(res, out)
+
+        with self.assertRaises(ValueError):
+            apply_batched(np.negative, arr, arr, 3, out=np.zeros(6))
+
+    def test_get_file_backing(self):
+        fname = make_temp_filename(suffix=".npy")
+        try:
+            arr = np.lib.format.open_memmap(fname, mode="w+", dtype=np.float32, shape=(4, 2))
+            self.assertEqual(
+                get_file_backing(arr), (os.path.abspath(fname), arr.offset)
+            )
+            self.assertIsNone(get_file_backing(arr[1:])) # a slice starts elsewhere in the file
+            self.assertIsNone(get_file_backing(np.zeros(3)))
+            self.assertIsNone(get_file_backing(None))
+            del arr
+            self.assertIsNone(get_file_backing(np.load(fname, mmap_mode="r")))
+        finally:
+            os.remove(fname)
+
+
     def test_batched(self):
         arr = np.arange(3)
 
@@ -259,4 +335,304 @@ class TestUtils(TestCase):
             self.assertEqual(res, tout)
 
 
+    def test_indices_to_runs(self):
+        starts, stops = indices_to_runs([])
+        self.assertAllEqual(starts, [])
+        self.assertAllEqual(stops, [])
+
+        starts, stops = indices_to_runs([0, 1, 2, 5, 7, 8])
+        self.assertAllEqual(starts, [0, 5, 7])
+        self.assertAllEqual(stops, [3, 6, 9])
+
+    def test_as_sorted_indices(self):
+        ntotal = 5
+        self.assertAllEqual(as_sorted_indices([], ntotal), [])
+        self.assertAllEqual(as_sorted_indices([0, 2, 4], ntotal), [0, 2, 4])
+        self.assertAllEqual(as_sorted_indices([True, False, True, False, True], ntotal), [0, 2, 4])
+        for valid in ([2, 0], [0, 0], [-1, 2], [0, 5], [True, False], [[0, 1]], [0.5]):
+            self.assertEqual(as_sorted_indices(valid, ntotal), None)
+
+
+    def test_read_valid(self):
+        fname = make_temp_filename(suffix=".h5")
+        arr = np.arange(100 * 3).reshape(100, 3)
+
+        with h5py.File(fname, "w") as f:
+            datasets = (
+                f.create_dataset("contiguous", data=arr),
+                f.create_dataset("chunked", data=arr, chunks=(10, 3)),
+                f.create_dataset("compressed", data=arr, chunks=(10, 3), compression="gzip"),
+                f.create_dataset("scalars", data=arr[:, 0], chunks=(7,))
+            )
+
+            patterns = (
+                [],
+                [42],
+                np.arange(10, 20),
+                np.arange(0, 100, 2),
+                np.arange(0, 100, 20),
+                np.arange(0, 100, 3),
+                np.arange(100) % 7 == 0,
+                [3, 1, 2] # unsorted is read in full and indexed afterwards
+            )
+
+            for ds in datasets:
+                self.assertAllEqual(read_valid(ds, Ellipsis), ds[:])
+                for valid in patterns:
+                    self.assertAllEqual(read_valid(ds, valid), ds[:][valid])
+
+            for ds in datasets:
+                for valid in (Ellipsis, *patterns):
+                    ref = ds[:][valid]
+                    out = np.empty(ref.shape, dtype=np.float32)
+                    res = read_valid(ds, valid, out=out)
+                    self.assertIs(res, out)
+                    self.assertAllEqual(out, ref)
+                    res = read_valid(ds, valid, dtype=np.float32)
+                    self.assertEqual(res.dtype, np.float32)
+                    self.assertAllEqual(res, ref)
+
+            col = f.create_dataset("column", data=arr[:, :1])
+            out = np.empty(50)
+            read_valid(col, np.arange(0, 100, 2), out=out) # squeezed column vector
+            self.assertAllEqual(out, arr[::2, 0])
+            with self.assertRaises(ValueError):
+                read_valid(col, np.arange(0, 100, 2), out=np.empty(49))
+            with self.assertRaises(ValueError):
+                read_valid(col, np.arange(0, 100, 2), out=np.empty((50, 2))[:, :1]) # not contiguous
+
+            ds = datasets[0]
+            self.assertEqual(plan_read(ds, np.array([], dtype=int))[0], "empty")
+            self.assertEqual(plan_read(ds, np.arange(10, 20))[0], "span")
+            self.assertEqual(plan_read(ds, np.arange(0, 100, 2))[0], "span")
+            self.assertEqual(plan_read(ds, np.arange(0, 100, 20))[0], "slices")
+            self.assertEqual(plan_read(ds, np.arange(0, 100, 3))[0], "hyperslab")
+
+            ds = datasets[1]
+            self.assertEqual(plan_read(ds, np.arange(0, 100, 3))[0], "span") # every chunk is needed
+            self.assertEqual(plan_read(ds, np.arange(0, 100, 30))[0], "slices")
+
+        os.remove(fname)
+
+
+    def test_batch_slices_aligned(self):
+        class FakeChunkedDataset:
+            chunks = (4,)
+
+        ds = FakeChunkedDataset()
+        indices = np.arange(10)
+
+        res = batch_slices(ds, indices, 3, aligned=False)
+        self.assertEqual(res, [slice(0, 3), slice(3, 6), slice(6, 9), slice(9, 12)])
+
+        res = batch_slices(ds, indices, 3, aligned=True) # at least one chunk per batch
+        self.assertEqual(res, [slice(0, 4), slice(4, 8), slice(8, 10)])
+
+        res = batch_slices(ds, indices, 9, aligned=True)
+        self.assertEqual(res, [slice(0, 8), slice(8, 10)])
+
+        res = batch_slices(ds, indices, 9, nbatches=1, aligned=True)
+        self.assertEqual(res, [slice(0, 8)])
+
+        indices = np.array([0, 1, 5, 9, 10, 11, 12, 13])
+        res = batch_slices(ds, indices, 3, aligned=True) # chunks: [0, 1], [5], [9, 10, 11], [12, 13]
+        self.assertEqual(res, [slice(0, 3), slice(3, 6), slice(6, 8)])
+
+        res = batch_slices(np.arange(10), np.arange(10), 3, aligned=True) # not chunked
+        self.assertEqual(res, batch_slices(ds, np.arange(10), 3, aligned=False))
+
+        self.assertEqual(batch_slices(ds, [], 3, aligned=True), [])
+
+
+    def test_batched_aligned(self):
+        fname = make_temp_filename(suffix=".h5")
+        arr = np.arange(100 * 3).reshape(100, 3)
+        indices = np.arange(0, 100, 3)
+        nop = lambda x: x
+
+        with h5py.File(fname, "w") as f:
+            ds = f.create_dataset("chunked", data=arr, chunks=(10, 3), compression="gzip")
+            for aligned in (True, False):
+                for size in (1, 7, 10, 50, 200):
+                    res = [batch for _index, batch in batched(ds, indices, size, aligned=aligned)]
+                    res = np.concatenate(res)
+                    self.assertAllEqual(res, arr[indices])
+
+                    res = apply_batched(nop, ds, indices, size, aligned=aligned)
+                    self.assertAllEqual(res, arr[indices])
+
+                    slices = batch_slices(ds, indices, size, nbatches=2, aligned=aligned)
+                    res = apply_batched(nop, ds, indices, size, nbatches=2, aligned=aligned)
+                    self.assertAllEqual(res, arr[indices][:slices[-1].stop])
+
+        os.remove(fname)
+
+
+    def test_prefetched(self):
+        items = list(range(10))
+        for n in (0, None, 1, 3, 100):
+            self.assertEqual(list(prefetched(items, n)), items)
+
+        def broken():
+            yield 1
+            raise ValueError("test")
+
+        gen = prefetched(broken(), 2)
+        self.assertEqual(next(gen), 1)
+        with self.assertRaises(ValueError):
+            next(gen)
+
+        produced = []
+        def produce():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        gen = prefetched(produce(), 2)
+        self.assertEqual(next(gen), 0)
+        gen.close() # stops and joins the background thread
+        self.assertLess(len(produced), 100)
+
+
+    def test_background_writer(self):
+        written = []
+        bw = BackgroundWriter(queue_size=2)
+        for i in range(10):
+            bw.submit(written.append, i)
+        bw.flush()
+        self.assertEqual(written, list(range(10)))
+
+        started = threading.Event()
+        release = threading.Event()
+        def block():
+            started.set()
+            release.wait()
+
+        bw.submit(block)
+        started.wait()
+        bw.submit(written.append, 10)
+        bw.submit(written.append, 11)
+        self.assertTrue(bw.queue.full()) # a further submit would block
+        release.set()
+        bw.flush()
+        self.assertEqual(written[-2:], [10, 11])
+
+        def broken():
+            raise ValueError("test")
+
+        bw.submit(broken)
+        bw.submit(written.append, 12) # dropped since broken failed
+        with self.assertRaises(ValueError):
+            bw.flush()
+        self.assertNotIn(12, written)
+
+        bw.submit(written.append, 13)
+        bw.submit(broken)
+        with self.assertRaises(ValueError):
+            bw.close()
+        self.assertEqual(written[-1], 13)
+        with self.assertRaises(RuntimeError):
+            bw.submit(written.append, 14)
+
+
+    def test_compress_chunk(self):
+        chunk = np.arange(3 * 50 * 60, dtype=np.int32).reshape(3, 50, 60)
+        fname = make_temp_filename(".h5")
+        try:
+            with h5py.File(fname, "w") as f:
+                ds = f.create_dataset("data", data=chunk, chunks=chunk.shape, **get_bshuf_kwargs())
+                _filter_mask, ref = ds.id.read_direct_chunk((0, 0, 0))
+            self.assertEqual(
+                compress_chunk(chunk), ref
+            )
+            self.assertAllEqual(
+                decompress_chunk(ref, chunk.shape, chunk.dtype), chunk
+            )
+        finally:
+            os.remove(fname)
+
+
+    def test_batched_prefetch(self):
+        arr = np.arange(10)
+        nop = lambda x: x
+        for size in (1, 3, 20):
+            ref = list(batched(arr, arr, size))
+            res = list(batched(arr, arr, size, prefetch=2))
+            self.assertEqual(len(res), len(ref))
+            for (rind, rarr), (lind, larr) in zip(res, ref):
+                self.assertEqual(rind, lind)
+                self.assertAllEqual(rarr, larr)
+
+            res = apply_batched(nop, arr, arr, size, prefetch=2)
+            self.assertAllEqual(res, arr)
+
+
+    def test_pid_alignment(self):
+        pids = [
+            np.array([1, 2, 3, 5]),
+            np.array([2, 3, 4, 5, 6]),
+            np.array([5, 3, 3, 2]) # unsorted and duplicated
+        ]
+        al = PIDAlignment(["a", "b", "c"], pids)
+        self.assertAllEqual(
+            al.all_pids, [1, 2, 3, 4, 5, 6]
+        )
+        self.assertAllEqual(
+            al.shared_pids, [2, 3, 5]
+        )
+        self.assertAllEqual(
+            al.counts, [4, 5, 3]
+        )
+        self.assertAllEqual(
+            al.presence_matrix(), [
+                [1, 1, 1, 0, 1, 0],
+                [0, 1, 1, 1, 1, 1],
+                [0, 1, 1, 0, 1, 0]
+            ]
+        )
+        for i, p in enumerate(pids):
+            _inters, ref, _ind = np.intersect1d(p, al.shared_pids, return_indices=True)
+            self.assertAllEqual(
+                al.shared_indices(i), ref
+            )
+
+
+    def test_get_profile_kwargs(self):
+        self.assertEqual(
+            get_profile_kwargs(None), {}
+        )
+        self.assertEqual(
+            get_profile_kwargs("sequential-frames"), PROFILES["sequential-frames"]
+        )
+        self.assertEqual(
+            get_profile_kwargs({"rdcc_nbytes": 1}), {"rdcc_nbytes": 1}
+        )
+        with self.assertRaises(ValueError):
+            get_profile_kwargs("notaprofile")
+
+
+    def test_concat_dataset(self):
+        parts = [np.arange(12).reshape(4, 3), np.arange(12, 18).reshape(2, 3), np.arange(18, 27).reshape(3, 3)]
+        ref = np.concatenate(parts)
+        ds = ConcatDataset(lambda: parts)
+        self.assertEqual(
+            ds.shape, ref.shape
+        )
+        for key in (5, -1, slice(None), slice(2, 7), slice(None, None, -2), (slice(3, 8), 1), [8, 0, 4, 4], ref[:, 0] % 2 == 0):
+            self.assertAllEqual(
+                ds[key], ref[key]
+            )
+        self.assertAllEqual(
+            read_valid(ds, [1, 4, 5, 8]), ref[[1, 4, 5, 8]]
+        )
+        for valid in ([1, 4, 5, 8], [8, 0, 4]):
+            out = np.empty((len(valid), 3))
+            read_valid(ds, valid, out=out)
+            self.assertAllEqual(
+                out, ref[valid]
+            )
+        with self.assertRaises(IndexError):
+            ds[9]
+
+
 
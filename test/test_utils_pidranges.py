@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from utils import TestCase
+
+from sfdata.utils.pidranges import PIDRanges
+
+
+STRIDE1  = np.r_[np.arange(0, 100), np.arange(105, 200)]         # one gap
+STRIDE10 = np.r_[np.arange(0, 100, 10), np.arange(150, 300, 10)] # rep-rate stride with one gap
+IRREGULAR = np.array([3, 4, 5, 17, 42, 43, 99])
+
+
+class TestUtilsPIDRanges(TestCase):
+
+    def test_from_array(self):
+        for arr in (STRIDE1, STRIDE10, IRREGULAR, []):
+            ranges = PIDRanges.from_array(arr)
+            self.assertAllEqual(
+                ranges.to_array(), arr
+            )
+            self.assertAllEqual(
+                np.asarray(ranges), arr
+            )
+            self.assertEqual(
+                list(ranges), list(arr)
+            )
+            self.assertEqual(
+                len(ranges), len(arr)
+            )
+
+    def test_nruns(self):
+        self.assertEqual(PIDRanges.from_array(STRIDE1).nruns, 2)
+        self.assertEqual(PIDRanges.from_array(STRIDE10).nruns, 2)
+
+    def test_from_array_invalid(self):
+        for arr in ([1, 1, 2], [2, 1], [[1, 2]], [0.5, 1.5]):
+            with self.assertRaises(ValueError):
+                PIDRanges.from_array(arr)
+
+    def test_from_array_too_many_runs(self):
+        rng = np.random.default_rng(0)
+        arr = np.unique(rng.integers(0, 10**6, size=10**4))
+        with self.assertRaises(ValueError):
+            PIDRanges.from_array(arr)
+        self.assertAllEqual(
+            PIDRanges.from_array(arr, limit=False).to_array(), arr
+        )
+
+    def test_dtype(self):
+        arr = STRIDE1.astype(np.uint64)
+        ranges = PIDRanges.from_array(arr)
+        self.assertEqual(
+            ranges.to_array().dtype, np.uint64
+        )
+
+    def test_set_operations(self):
+        arrays = (STRIDE1, STRIDE10, IRREGULAR, np.array([], dtype=int))
+        for a in arrays:
+            for b in arrays:
+                ra = PIDRanges.from_array(a)
+                rb = PIDRanges.from_array(b)
+                self.assertAllEqual(
+                    (ra & rb).to_array(), np.intersect1d(a, b)
+                )
+                self.assertAllEqual(
+                    (ra | rb).to_array(), np.union1d(a, b)
+                )
+
+    def test_union_stays_compact(self):
+        ra = PIDRanges.from_array(np.arange(1000))
+        rb = PIDRanges.from_array(np.arange(0, 1000, 10))
+        self.assertEqual(
+            (ra | rb).nruns, 1
+        )
+        self.assertEqual(
+            (ra & rb).nruns, 1
+        )
+
+    def test_membership(self):
+        ranges = PIDRanges.from_array(STRIDE10)
+        self.assertTrue(10 in ranges)
+        self.assertFalse(11 in ranges)
+        self.assertFalse(100 in ranges)
+        self.assertFalse(-10 in ranges)
+        values = np.arange(-20, 320)
+        self.assertAllEqual(
+            ranges.contains(values), np.isin(values, STRIDE10)
+        )
+
+    def test_positions(self):
+        for arr in (STRIDE1, STRIDE10, IRREGULAR):
+            ranges = PIDRanges.from_array(arr)
+            self.assertAllEqual(
+                ranges.positions(arr), np.arange(len(arr))
+            )
+            self.assertAllEqual(
+                ranges.positions([-1, 1000]), [-1, -1]
+            )
+
+    def test_repr(self):
+        ranges = PIDRanges.from_array(STRIDE1)
+        self.assertEqual(
+            repr(ranges), "PIDRanges: 195 pulse IDs in 2 runs"
+        )
+
+
+